@@ -0,0 +1,81 @@
+"""Property checks and throughput of the Secret Santa assignment engine.
+
+Run with `python -m benchmarks.assignment`.
+"""
+
+from collections import Counter
+from math import sqrt
+from random import Random
+from time import perf_counter
+
+from super_secret_santa.secret_santa import AssignmentMode, secret_santa_algo
+
+SEED = 2024
+
+
+def check_valid(members: list[int], assignments: list[tuple], mode: AssignmentMode):
+    givers = [giver for giver, _ in assignments]
+    receivers = [receiver for _, receiver in assignments]
+    assert sorted(givers) == sorted(members), "every member must give exactly once"
+    assert sorted(receivers) == sorted(members), "every member must receive exactly once"
+    assert all(giver != receiver for giver, receiver in assignments), "nobody may draw themselves"
+
+    if mode == AssignmentMode.SINGLE_CYCLE:
+        successor = dict(assignments)
+        current, length = members[0], 0
+        while True:
+            current, length = successor[current], length + 1
+            if current == members[0]:
+                break
+        assert length == len(members), "single-cycle mode must produce one gift chain"
+
+
+def chi_square_critical(df: int, z: float = 3.09) -> float:
+    # Wilson-Hilferty approximation of the chi-square quantile, z = 3.09 is p = 0.001
+    return df * (1 - 2 / (9 * df) + z * sqrt(2 / (9 * df))) ** 3
+
+
+def check_uniform(n: int, mode: AssignmentMode, samples_per_outcome: int = 500):
+    rng = Random(SEED)
+    members = list(range(n))
+    outcomes = Counter()
+    expected_outcomes = {AssignmentMode.DERANGEMENT: [1, 0, 1, 2, 9, 44, 265], AssignmentMode.SINGLE_CYCLE: None}
+    count = expected_outcomes[mode][n] if mode == AssignmentMode.DERANGEMENT else _factorial(n - 1)
+
+    samples = count * samples_per_outcome
+    for _ in range(samples):
+        assignments = secret_santa_algo(members, mode, rng)
+        check_valid(members, assignments, mode)
+        outcomes[tuple(receiver for _, receiver in assignments)] += 1
+
+    assert len(outcomes) == count, f"expected {count} distinct outcomes, got {len(outcomes)}"
+    expected = samples / count
+    chi_square = sum((observed - expected) ** 2 / expected for observed in outcomes.values())
+    critical = chi_square_critical(count - 1)
+    assert chi_square < critical, f"not uniform: chi-square {chi_square:.1f} >= {critical:.1f}"
+    print(f"{mode:>12} n={n}: {count} outcomes, chi-square {chi_square:.1f} < {critical:.1f}")
+
+
+def _factorial(n: int) -> int:
+    return 1 if n <= 1 else n * _factorial(n - 1)
+
+
+def throughput(n: int, mode: AssignmentMode, repeat: int = 3):
+    rng = Random(SEED)
+    members = list(range(n))
+    best = float("inf")
+    for _ in range(repeat):
+        start = perf_counter()
+        assignments = secret_santa_algo(members, mode, rng)
+        best = min(best, perf_counter() - start)
+    check_valid(members, assignments, mode)
+    print(f"{mode:>12} n={n:>7}: {best * 1000:8.1f} ms ({n / best:,.0f} participants/s)")
+
+
+if __name__ == "__main__":
+    for mode in AssignmentMode:
+        for n in range(3, 7):
+            check_uniform(n, mode)
+    for mode in AssignmentMode:
+        for n in (3, 100, 10_000, 100_000, 1_000_000):
+            throughput(n, mode)
@@ -0,0 +1,57 @@
+"""Assignment time on dense constraint graphs, and time to prove infeasibility.
+
+Run with `python -m benchmarks.constraints`.
+"""
+
+from random import Random
+from time import perf_counter
+
+from super_secret_santa.secret_santa import InfeasibleAssignmentError, secret_santa_algo
+
+SEED = 2024
+TIME_BUDGET = 10
+
+
+def random_constraints(members: list[int], density: float, rng: Random) -> set[tuple[int, int]]:
+    return {(a, b) for a in members for b in members if a != b and rng.random() < density}
+
+
+def run(n: int, density: float):
+    rng = Random(SEED)
+    members = list(range(n))
+    forbidden = random_constraints(members, density, rng)
+
+    start = perf_counter()
+    try:
+        assignments = secret_santa_algo(members, rng=rng, forbidden=forbidden, time_budget=TIME_BUDGET)
+        assert all(pair not in forbidden and pair[0] != pair[1] for pair in assignments)
+        outcome = "ok"
+    except InfeasibleAssignmentError:
+        outcome = "infeasible"
+    except TimeoutError:
+        outcome = "timeout"
+    elapsed = perf_counter() - start
+    print(f"n={n:>5} density={density:.2f} forbidden={len(forbidden):>9}: {outcome:>10} in {elapsed * 1000:9.1f} ms")
+
+
+def run_infeasible(n: int):
+    # one member nobody may draw: Hall's condition fails, the search must say so quickly
+    rng = Random(SEED)
+    members = list(range(n))
+    forbidden = {(giver, 0) for giver in members[1:]}
+
+    start = perf_counter()
+    try:
+        secret_santa_algo(members, rng=rng, forbidden=forbidden, time_budget=TIME_BUDGET)
+        raise AssertionError("expected an infeasible assignment")
+    except InfeasibleAssignmentError:
+        pass
+    print(f"n={n:>5} unreachable member: infeasible in {(perf_counter() - start) * 1000:9.1f} ms")
+
+
+if __name__ == "__main__":
+    for n in (10, 100, 1000):
+        for density in (0.1, 0.5, 0.9, 0.99):
+            run(n, density)
+    for n in (10, 100, 1000, 3000):
+        run_infeasible(n)
@@ -0,0 +1,186 @@
+"""Time and peak memory of the CPU-bound hot spots, with a regression check against a baseline.
+
+Measures the assignment engine from 3 to 1M participants and the PDF rendering from 14 to 10,000
+cells (output size per page too). Every case runs for a few rounds, then once more under
+tracemalloc for its peak memory.
+
+Run with `python -m benchmarks.hotspots`. Save the results of a release with `--save
+baseline.json`, then check a change against them with `--compare baseline.json`: this fails if
+the median time or the peak memory of a case grew by more than `--threshold` (20% by default).
+`-k` only runs the cases whose name contains one of the given strings.
+"""
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import tracemalloc
+from collections.abc import Callable
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+from math import ceil
+from random import Random
+from statistics import mean, median, stdev
+from time import perf_counter
+
+from super_secret_santa import pdf
+from super_secret_santa.secret_santa import AssignmentMode, secret_santa_algo
+
+SEED = 2024
+SNOWFLAKE = 308427430385418270
+PARTICIPANTS = (3, 100, 10_000, 100_000, 1_000_000)
+CELLS = (14, 100, 1_000, 10_000)
+MIN_TIME = 1  # seconds spent on the rounds of a case, at least one round is run
+MAX_ROUNDS = 20
+
+
+@dataclass
+class Result:
+    name: str
+    group: str
+    params: dict
+    rounds: int
+    min: float  # seconds
+    median: float
+    mean: float
+    stddev: float
+    peak_memory: int  # bytes allocated at most, as seen by tracemalloc
+    extra: dict = field(default_factory=dict)
+
+
+def bench(name: str, group: str, params: dict, run: Callable[[], object], setup: Callable[[], None] = lambda: None):
+    """Time `run` (after `setup`, which is not timed) for a few rounds, then measure its peak memory once."""
+    times = []
+    while not times or (sum(times) < MIN_TIME and len(times) < MAX_ROUNDS):
+        setup()
+        start = perf_counter()
+        output = run()
+        times.append(perf_counter() - start)
+
+    setup()
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    result = Result(
+        name,
+        group,
+        params,
+        rounds=len(times),
+        min=min(times),
+        median=median(times),
+        mean=mean(times),
+        stddev=stdev(times) if len(times) > 1 else 0.0,
+        peak_memory=peak,
+    )
+    return result, output
+
+
+def assignment_cases() -> list[tuple[str, Callable[[], Result]]]:
+    def case(mode: AssignmentMode, n: int) -> Result:
+        members = list(range(n))
+        rng = Random(SEED)
+        result, _ = bench(
+            f"assignment[{mode}-{n}]",
+            "assignment",
+            {"mode": str(mode), "participants": n},
+            lambda: secret_santa_algo(members, mode, rng),
+        )
+        result.extra["participants_per_second"] = round(n / result.median)
+        return result
+
+    return [
+        (f"assignment[{mode}-{n}]", lambda mode=mode, n=n: case(mode, n)) for mode in AssignmentMode for n in PARTICIPANTS
+    ]
+
+
+def pdf_cases() -> list[tuple[str, Callable[[], Result]]]:
+    def case(cells: int) -> Result:
+        data_list = [(f"Member {i}", SNOWFLAKE + i) for i in range(cells)]
+        pages = ceil(cells / pdf.Layout().cells_per_page)
+        # every cell has a giftee of its own, so every QR code is encoded like on a first render
+        result, output = bench(
+            f"pdf[{cells}]", "pdf", {"cells": cells}, lambda: pdf.render_pdf(data_list), setup=pdf.qr_code_runs.cache_clear
+        )
+        result.extra |= {
+            "pages": pages,
+            "pages_per_second": round(pages / result.median, 1),
+            "output_bytes": len(output),
+            "bytes_per_page": len(output) // pages,
+        }
+        return result
+
+    return [(f"pdf[{cells}]", lambda cells=cells: case(cells)) for cells in CELLS]
+
+
+def compare(results: list[Result], baseline: dict, threshold: float) -> list[str]:
+    """Describe every case that got slower or hungrier than in `baseline` by more than `threshold`."""
+    previous = {entry["name"]: entry for entry in baseline["benchmarks"]}
+    regressions = []
+    for result in results:
+        if (entry := previous.get(result.name)) is None:
+            continue
+        for metric, value in (("median", result.median), ("peak_memory", result.peak_memory)):
+            if entry[metric] and (ratio := value / entry[metric]) > 1 + threshold:
+                regressions.append(f"{result.name}: {metric} {entry[metric]:.4g} -> {value:.4g} ({ratio - 1:+.0%})")
+    return regressions
+
+
+def _revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-k", nargs="*", default=[], help="only run the cases whose name contains one of these")
+    parser.add_argument("--save", help="file to write the JSON results to")
+    parser.add_argument("--compare", help="JSON results of a previous run to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.2, help="relative growth counted as a regression")
+    args = parser.parse_args()
+
+    results = []
+    for name, run in assignment_cases() + pdf_cases():
+        if args.k and not any(pattern in name for pattern in args.k):
+            continue
+        results.append(result := run())
+        extra = ", ".join(f"{key}={value:,}" for key, value in result.extra.items())
+        print(
+            f"{result.name:>36}: median {result.median * 1000:10.2f} ms ± {result.stddev * 1000:8.2f} "
+            f"({result.rounds:>2} rounds), peak {result.peak_memory / 2**20:8.2f} MiB, {extra}"
+        )
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(
+                {
+                    "machine_info": {"python": platform.python_version(), "platform": platform.platform()},
+                    "commit": _revision(),
+                    "datetime": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                    "benchmarks": [asdict(result) for result in results],
+                },
+                f,
+                indent=2,
+            )
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+        print(f"No regression beyond {args.threshold:.0%} against {args.compare}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
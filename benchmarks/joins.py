@@ -0,0 +1,79 @@
+"""Contention of a burst of simultaneous "Join" clicks on one campaign.
+
+Compares the former per-guild advisory lock, which serialized every join, with the row-level
+locking used now. Needs the database configured in config.ini, the campaigns it creates use
+random guild IDs and are deleted afterwards.
+
+Run with `python -m benchmarks.joins`.
+"""
+
+import asyncio
+from random import Random
+from statistics import quantiles
+from time import perf_counter
+
+from psycopg_pool import AsyncConnectionPool
+
+from super_secret_santa.database import JoinStatus, TimedCursor, conninfo, join_campaign
+
+SEED = 2024
+POOL_SIZE = 20
+
+
+async def advisory_join(cur, guild_id: int, user_id: int) -> JoinStatus:
+    await cur.execute("SELECT pg_advisory_xact_lock(%s);", (guild_id,))
+    return await join_campaign(cur, guild_id, user_id)
+
+
+async def burst(pool: AsyncConnectionPool, join, clicks: int, rng: Random):
+    guild_id = rng.getrandbits(62)
+    async with pool.connection() as conn:
+        await conn.execute("INSERT INTO Campaigns (guild_id, name) VALUES (%s, 'benchmark');", (guild_id,))
+
+    latencies = []
+
+    async def click(user_id: int) -> JoinStatus:
+        start = perf_counter()
+        async with pool.connection() as conn:
+            status = await join(conn.cursor(), guild_id, user_id)
+        latencies.append(perf_counter() - start)
+        return status
+
+    # every user clicks twice, the second click must be reported as a duplicate
+    user_ids = [rng.getrandbits(62) for _ in range(clicks // 2)] * 2
+    rng.shuffle(user_ids)
+    start = perf_counter()
+    try:
+        statuses = await asyncio.gather(*(click(user_id) for user_id in user_ids))
+        elapsed = perf_counter() - start
+        async with pool.connection() as conn:
+            cur = await conn.execute("SELECT count(*) FROM Memberships WHERE guild_id = %s;", (guild_id,))
+            (members,) = await cur.fetchone()
+    finally:
+        async with pool.connection() as conn:
+            await conn.execute("DELETE FROM Campaigns WHERE guild_id = %s;", (guild_id,))
+
+    joined = statuses.count(JoinStatus.JOINED)
+    assert joined == members == len(set(user_ids)), f"{joined} joins reported, {members} members stored"
+    assert statuses.count(JoinStatus.ALREADY_JOINED) == len(user_ids) - joined
+
+    p50, p99 = (quantiles(latencies, n=100)[i] for i in (49, 98))
+    print(
+        f"{join.__name__:>14} clicks={len(user_ids):>5}: {elapsed * 1000:8.1f} ms total, "
+        f"p50 {p50 * 1000:7.1f} ms, p99 {p99 * 1000:7.1f} ms ({len(user_ids) / elapsed:,.0f} joins/s)"
+    )
+
+
+async def main():
+    rng = Random(SEED)
+    # the bot's cursors, which take the statement names of its queries
+    async with AsyncConnectionPool(
+        conninfo, min_size=POOL_SIZE, max_size=POOL_SIZE, kwargs={"cursor_factory": TimedCursor}
+    ) as pool:
+        for clicks in (100, 500, 2000):
+            for join in (advisory_join, join_campaign):
+                await burst(pool, join, clicks, rng)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,332 @@
+"""Latency of the buttons and commands under concurrent load, against a local database.
+
+Replays synthetic workloads through the real `CampaignView` callbacks and `santa` commands, with
+stand-ins for the Discord interactions, contexts and users that answer after a simulated REST
+latency. Needs the database configured in config.ini, the campaigns it creates use random guild
+IDs and are deleted afterwards.
+
+Each workload records the p50/p99 latency of every operation, the SQL statements executed and
+connections borrowed, and how often backends were waiting for a lock (sampled from
+pg_stat_activity). The results are printed as JSON, to compare them between releases:
+
+    python -m benchmarks.load --output before.json
+    python -m benchmarks.load --join-users 2000 --guilds 200 --output after.json
+"""
+
+import argparse
+import asyncio
+import json
+import subprocess
+import sys
+from collections.abc import Awaitable, Callable
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+from random import Random
+from statistics import quantiles
+from time import perf_counter
+
+from psycopg import AsyncConnection
+
+from super_secret_santa import dispatcher, metrics, startup
+from super_secret_santa.bot import bot
+from super_secret_santa.database import conninfo, connection_pool, get_connection, stats
+from super_secret_santa.views import CampaignView
+
+SEED = 2024
+LOCK_SAMPLE_INTERVAL = 0.005  # seconds
+
+
+# Discord stand-ins, with just what the callbacks use
+
+
+class FakeMessage:
+    def __init__(self, harness: "Harness", content: str | None = None):
+        self.harness = harness
+        self.id = harness.rng.getrandbits(62)
+        self.content = content
+
+    async def edit(self, content: str | None = None, **_):
+        await self.harness.rest_call()
+        self.content = content
+
+
+class FakeMessageable:
+    """A channel, a followup webhook or a user's DMs: anything messages are sent to."""
+
+    def __init__(self, harness: "Harness"):
+        self.harness = harness
+        self.sent: list[str | None] = []
+
+    async def send(self, content: str | None = None, **_) -> FakeMessage:
+        await self.harness.rest_call()
+        self.sent.append(content)
+        return FakeMessage(self.harness, content)
+
+
+class FakeUser(FakeMessageable):
+    def __init__(self, harness: "Harness", user_id: int):
+        super().__init__(harness)
+        self.id = user_id
+        self.name = self.global_name = self.display_name = f"user{user_id % 10_000}"
+        self.mention = f"<@{user_id}>"
+
+
+class FakeGuild:
+    def __init__(self, harness: "Harness", guild_id: int):
+        self.harness = harness
+        self.id = guild_id
+
+    def get_member(self, user_id: int) -> FakeUser | None:
+        return self.harness.users.get(user_id)
+
+
+class FakeResponse:
+    def __init__(self, harness: "Harness"):
+        self.harness = harness
+
+    async def defer(self, **_):
+        await self.harness.rest_call()
+
+
+class FakeInteraction:
+    def __init__(self, harness: "Harness", guild: FakeGuild, user: FakeUser):
+        self.guild = guild
+        self.user = user
+        self.message = FakeMessage(harness)
+        self.channel = FakeMessageable(harness)
+        self.response = FakeResponse(harness)
+        self.followup = FakeMessageable(harness)
+
+
+class FakeContext:
+    def __init__(self, harness: "Harness", guild: FakeGuild | None, author: FakeUser):
+        self.harness = harness
+        self.guild = guild
+        self.author = author
+        self.channel = FakeMessageable(harness)
+        self.followup = FakeMessageable(harness)
+
+    async def defer(self, **_):
+        await self.harness.rest_call()
+
+    async def respond(self, content: str | None = None, **_):
+        await self.followup.send(content)
+
+
+# Measurements
+
+
+@dataclass
+class LockWaits:
+    samples: int = 0  # samples with at least one backend waiting for a lock
+    max_waiting: int = 0  # most backends waiting at once
+    wait_seconds: float = 0  # backends waiting, integrated over the sampling interval
+
+
+@dataclass
+class WorkloadResult:
+    operations: int
+    errors: int
+    seconds: float
+    throughput: float  # operations per second
+    latency_ms: dict[str, float]  # p50, p90, p99, max
+    db_statements: int  # round trips, except that a pipeline counts one per statement
+    db_connections: int  # borrowed from the pool
+    lock_waits: LockWaits = field(default_factory=LockWaits)
+
+
+def _statement_count() -> int:
+    return sum(sum(counts) for counts, _ in metrics.db_query_seconds._values.values())
+
+
+async def _sample_lock_waits(waits: LockWaits):
+    async with await AsyncConnection.connect(conninfo, autocommit=True) as conn:
+        while True:
+            cur = await conn.execute(
+                "SELECT count(*) FROM pg_stat_activity WHERE wait_event_type = 'Lock' AND datname = current_database();"
+            )
+            (waiting,) = await cur.fetchone()
+            if waiting:
+                waits.samples += 1
+                waits.max_waiting = max(waits.max_waiting, waiting)
+                waits.wait_seconds += waiting * LOCK_SAMPLE_INTERVAL
+            await asyncio.sleep(LOCK_SAMPLE_INTERVAL)
+
+
+class Harness:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.rng = Random(SEED)
+        self.users: dict[int, FakeUser] = {}
+        self.guilds: list[FakeGuild] = []
+        self.organizers: dict[int, FakeUser] = {}
+        commands = next(command for command in bot.pending_application_commands if command.name == "santa")
+        self.commands = {command.name: command.callback for command in commands.subcommands}
+        self.view = CampaignView()
+
+    async def rest_call(self):
+        await asyncio.sleep(self.args.discord_latency)
+
+    def new_user(self) -> FakeUser:
+        user = FakeUser(self, self.rng.getrandbits(62))
+        self.users[user.id] = user
+        return user
+
+    async def create_campaign(self) -> FakeGuild:
+        guild, organizer = FakeGuild(self, self.rng.getrandbits(62)), self.new_user()
+        self.guilds.append(guild)
+        self.organizers[guild.id] = organizer
+        await self.commands["create"](FakeContext(self, guild, organizer), campaign_name="load test")
+        return guild
+
+    async def click(self, button: str, guild: FakeGuild, user: FakeUser):
+        await getattr(self.view, button).callback(FakeInteraction(self, guild, user))
+
+    async def measure(self, operations: list[tuple[float, Callable[[], Awaitable]]]) -> WorkloadResult:
+        """Run every operation at its offset in seconds from now, all concurrently."""
+        latencies = []
+
+        async def run(offset: float, operation: Callable[[], Awaitable]):
+            await asyncio.sleep(offset)
+            start = perf_counter()
+            try:
+                await operation()
+            finally:
+                latencies.append(perf_counter() - start)
+
+        waits = LockWaits()
+        sampler = asyncio.create_task(_sample_lock_waits(waits))
+        statements, connections = _statement_count(), stats.acquired
+        start = perf_counter()
+        try:
+            results = await asyncio.gather(*(run(*operation) for operation in operations), return_exceptions=True)
+        finally:
+            sampler.cancel()
+        elapsed = perf_counter() - start
+
+        for error in {repr(result) for result in results if isinstance(result, Exception)}:
+            print(f"error: {error}", file=sys.stderr)
+        percentiles = quantiles(latencies, n=100, method="inclusive")
+        return WorkloadResult(
+            operations=len(operations),
+            errors=sum(isinstance(result, Exception) for result in results),
+            seconds=round(elapsed, 3),
+            throughput=round(len(operations) / elapsed, 1),
+            latency_ms={
+                "p50": round(percentiles[49] * 1000, 2),
+                "p90": round(percentiles[89] * 1000, 2),
+                "p99": round(percentiles[98] * 1000, 2),
+                "max": round(max(latencies) * 1000, 2),
+            },
+            db_statements=_statement_count() - statements,
+            db_connections=stats.acquired - connections,
+            lock_waits=waits,
+        )
+
+    # Workloads
+
+    async def join_burst(self) -> WorkloadResult:
+        """`join_users` users clicking "Join" on one campaign within `join_window` seconds."""
+        guild = await self.create_campaign()
+        users = [self.new_user() for _ in range(self.args.join_users)]
+        return await self.measure(
+            [
+                (self.rng.uniform(0, self.args.join_window), lambda user=user: self.click("join_button_callback", guild, user))
+                for user in users
+            ]
+        )
+
+    async def start_storm(self) -> WorkloadResult:
+        """`guilds` organizers clicking "Start" at once, on campaigns of `members` members each."""
+        guilds = await asyncio.gather(*(self.create_campaign() for _ in range(self.args.guilds)))
+        await asyncio.gather(
+            *(
+                self.click("join_button_callback", guild, self.new_user())
+                for guild in guilds
+                for _ in range(self.args.members - 1)
+            )
+        )
+        return await self.measure(
+            [
+                (0, lambda guild=guild: self.click("start_button_callback", guild, self.organizers[guild.id]))
+                for guild in guilds
+            ]
+        )
+
+    async def message_storm(self) -> WorkloadResult:
+        """Every member of the started campaigns sending `/santa message` within `message_window` seconds."""
+        givers = [user for user in self.users.values() if user.sent]  # those who got an assignment
+        return await self.measure(
+            [
+                (
+                    self.rng.uniform(0, self.args.message_window),
+                    lambda user=user: self.commands["message"](FakeContext(self, None, user), message="ho ho ho"),
+                )
+                for user in givers
+            ]
+        )
+
+    async def cleanup(self):
+        async with get_connection() as conn:
+            await conn.execute(
+                "DELETE FROM Campaigns WHERE guild_id = ANY(%s);", ([guild.id for guild in self.guilds],)
+            )
+
+
+def _revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def main(args: argparse.Namespace) -> dict:
+    startup.setup()
+    harness = Harness(args)
+    # Discord is not involved, only the bot's side of the latency is measured
+    bot.get_user = harness.users.get
+    dispatcher.rate_limiter = dispatcher.RateLimiter(args.dm_rate, burst=max(1, int(args.dm_rate)))
+    await startup.prepare()
+    try:
+        workloads = {}
+        try:
+            # in this order: the messages go to the campaigns started just before
+            for workload in (harness.join_burst, harness.start_storm, harness.message_storm):
+                workloads[workload.__name__] = asdict(await workload())
+                print(f"{workload.__name__}: done", file=sys.stderr)
+        finally:
+            await harness.cleanup()
+    finally:
+        await connection_pool.close()
+
+    return {
+        "revision": _revision(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "settings": vars(args) | {"pool_max_size": connection_pool.max_size},
+        "workloads": workloads,
+    }
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--join-users", type=int, default=500, help="users clicking Join on one campaign")
+    parser.add_argument("--join-window", type=float, default=10, help="seconds the Join clicks are spread over")
+    parser.add_argument("--guilds", type=int, default=50, help="campaigns started at once")
+    parser.add_argument("--members", type=int, default=30, help="members of each started campaign")
+    parser.add_argument("--message-window", type=float, default=5, help="seconds the messages are spread over")
+    parser.add_argument("--discord-latency", type=float, default=0.05, help="seconds every simulated REST call takes")
+    parser.add_argument("--dm-rate", type=float, default=1000, help="direct messages per second, for all guilds")
+    parser.add_argument("--output", help="file to write the JSON results to, instead of stdout")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = json.dumps(asyncio.run(main(args)), indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(results + "\n")
+    else:
+        print(results)
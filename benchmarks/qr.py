@@ -0,0 +1,41 @@
+"""Pages per second and output size of vector QR codes versus the former PNG temp file path.
+
+Run with `python -m benchmarks.qr`.
+"""
+
+from io import BytesIO
+from tempfile import NamedTemporaryFile
+from time import perf_counter
+from unittest import mock
+
+from segno import make_qr
+
+from super_secret_santa import pdf
+
+PAGES = 20
+SNOWFLAKE = 308427430385418270
+
+
+def draw_png_qr_code(c, snowflake: int, x: float, y: float, size: float):
+    # how QR codes were drawn before: encode, write a PNG to disk, let ReportLab decode it again
+    with NamedTemporaryFile(suffix=".png") as f:
+        make_qr(f"https://discord.com/users/{snowflake}").save(f.name, scale=5, border=0)
+        c.drawImage(f.name, x, y, width=size, height=size)
+
+
+def run(label: str, data_list: list, cold: bool):
+    if cold:
+        pdf.qr_code_runs.cache_clear()
+    start = perf_counter()
+    output = BytesIO()
+    pdf.generate_pdf(data_list, output)
+    elapsed = perf_counter() - start
+    print(f"{label:>16}: {PAGES / elapsed:7.2f} pages/s, {len(output.getvalue()) / 1024:8.1f} KiB")
+
+
+if __name__ == "__main__":
+    data_list = [(f"Member {i}", SNOWFLAKE + i) for i in range(PAGES * pdf.Layout().cells_per_page)]
+    with mock.patch.object(pdf, "draw_qr_code", draw_png_qr_code):
+        run("PNG temp files", data_list, cold=True)
+    run("vector, cold", data_list, cold=True)
+    run("vector, cached", data_list, cold=False)
@@ -0,0 +1,97 @@
+"""Fail if a hot query falls back to a sequential scan on a large database.
+
+Seeds a few thousand campaigns into the database configured in config.ini, inside a transaction
+that is rolled back at the end, migrates it first if needed, and checks the EXPLAIN plan of every
+query run on each command or button press.
+
+Run with `python -m benchmarks.query_plans`.
+"""
+
+import asyncio
+import sys
+
+from psycopg import AsyncClientCursor, AsyncConnection
+
+from super_secret_santa import campaign_cache, commands, constants, database, outbox
+from super_secret_santa.database import conninfo
+from super_secret_santa.migrate import migrate
+
+GUILDS = 5_000
+MEMBERS_PER_GUILD = 40
+GUILD_ID = -42  # seeded guilds have negative IDs, not to mix with real ones
+USER_ID = -42 * MEMBERS_PER_GUILD  # the first member of GUILD_ID
+
+SEED = f"""
+INSERT INTO Campaigns (guild_id, name, state)
+SELECT -g, 'campaign ' || g, CASE WHEN g % 2 = 0 THEN 'started' ELSE 'awaiting' END::CampaignState
+FROM generate_series(1, {GUILDS}) AS g;
+
+INSERT INTO Giftees (user_id, guild_id)
+SELECT -g * {MEMBERS_PER_GUILD} - m, -g
+FROM generate_series(1, {GUILDS}) AS g, generate_series(0, {MEMBERS_PER_GUILD} - 1) AS m;
+
+INSERT INTO Memberships (user_id, guild_id, is_organizer, giftee)
+SELECT user_id, guild_id, user_id % {MEMBERS_PER_GUILD} = 0, id FROM Giftees WHERE guild_id < 0;
+
+INSERT INTO Exclusions (guild_id, giver_id, giftee_id)
+SELECT guild_id, user_id, user_id - 1 FROM Memberships WHERE guild_id < 0 AND user_id % 10 = 0;
+
+INSERT INTO PastAssignments (guild_id, started_at, giver_id, giftee_id)
+SELECT guild_id, TIMESTAMP '2000-12-01' + (y || ' years')::INTERVAL, user_id, user_id - 1
+FROM Memberships, generate_series(1, 3) AS y WHERE guild_id < 0;
+
+INSERT INTO Outbox (user_id, guild_id, content, sent_at)
+SELECT user_id, guild_id, 'message', CASE WHEN user_id % 100 <> 0 THEN CURRENT_TIMESTAMP END
+FROM Memberships WHERE guild_id < 0;
+
+ANALYZE Campaigns, Giftees, Memberships, Exclusions, PastAssignments, Outbox;
+"""
+
+# (name, query, parameters): the statements the bot runs, imported from where they are run, with the parameters
+# inlined so the plans are the ones actually run for GUILD_ID and USER_ID
+NOTIFY = {"channel": "santa_invalidate", "payload": "members:0:plans"}
+HOT_QUERIES = [
+    ("campaign cache load (every button, list, delete, exclude, pdf)", campaign_cache.LOAD_CAMPAIGN, (GUILD_ID,)),
+    ("giftee cache load (/santa message, messagex)", campaign_cache.LOAD_GIFTEES, (USER_ID,)),
+    ("join", database.JOIN_CAMPAIGN, {"guild_id": GUILD_ID, "user_id": USER_ID} | NOTIFY),
+    ("leave", database.LEAVE_CAMPAIGN, {"guild_id": GUILD_ID, "user_id": USER_ID} | NOTIFY),
+    ("start: lock", database.LOCK_CAMPAIGN, (GUILD_ID,)),
+    ("start: check", database.CHECK_START, {"guild_id": GUILD_ID, "user_id": USER_ID}),
+    ("/santa pdf", commands.PDF_ASSIGNMENTS, (GUILD_ID,)),
+    ("/santa exclusions", commands.LIST_EXCLUSIONS, (GUILD_ID,)),
+    # what the cascades run when a campaign is deleted
+    ("delete: giftees", "SELECT id FROM Giftees WHERE guild_id = %s", (GUILD_ID,)),
+    ("delete: giftee references", "SELECT 1 FROM Memberships WHERE giftee = %s", (42,)),
+    ("delete: outbox", "SELECT id FROM Outbox WHERE guild_id = %s", (GUILD_ID,)),
+    ("outbox retries", outbox.CLAIM, (constants.OUTBOX_MAX_ATTEMPTS, None, None, constants.OUTBOX_BATCH_SIZE)),
+    ("outbox: start button", outbox.CLAIM, (constants.OUTBOX_MAX_ATTEMPTS, GUILD_ID, GUILD_ID, None)),
+]
+
+
+def seq_scans(plan: dict) -> list[str]:
+    found = [plan["Relation Name"]] if plan["Node Type"] == "Seq Scan" else []
+    for child in plan.get("Plans", ()):
+        found += seq_scans(child)
+    return found
+
+
+async def main() -> int:
+    failures = 0
+    async with await AsyncConnection.connect(conninfo) as conn:
+        await migrate(conn)
+        async with conn.transaction(force_rollback=True):
+            await conn.execute(SEED)
+            for name, query, params in HOT_QUERIES:
+                query = AsyncClientCursor(conn).mogrify(query, params)
+                cur = await conn.execute(f"EXPLAIN (FORMAT JSON) {query}")
+                (plan,) = (await cur.fetchone())[0]
+                if scans := seq_scans(plan["Plan"]):
+                    failures += 1
+                    print(f"FAIL {name}: sequential scan on {', '.join(scans)}")
+                else:
+                    print(f"  ok {name}")
+    return failures
+
+
+if __name__ == "__main__":
+    sys.exit(1 if asyncio.run(main()) else 0)
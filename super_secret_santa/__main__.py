@@ -1,5 +1,95 @@
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import discord
+from loguru import logger
+
+from . import constants, startup
 from .config import config
-from .bot import bot
+from .bot import SHARD_IDS
+
+
+async def recommended_shard_count(token: str) -> int:
+    http = discord.http.HTTPClient()
+    try:
+        await http.static_login(token)
+        shards, _ = await http.get_bot_gateway()
+        return shards
+    finally:
+        await http.close()
+
+
+def shard_ranges(shard_count: int, clusters: int) -> list[list[int]]:
+    """Split the shards in `clusters` contiguous ranges of (almost) the same size."""
+    if shard_count < clusters:
+        raise ValueError(f"Cannot split {shard_count} shards across {clusters} clusters")
+    return [list(range(i * shard_count // clusters, (i + 1) * shard_count // clusters)) for i in range(clusters)]
+
+
+def launch(token: str, clusters: int):
+    """Run every range of shards in a worker process of its own, restarting the ones that exit."""
+    shards = config.get("Discord", "shards", fallback="auto") or "auto"
+    shard_count = asyncio.run(recommended_shard_count(token)) if shards == "auto" else int(shards)
+    ranges = shard_ranges(shard_count, clusters)
+
+    processes: dict[int, subprocess.Popen] = {}
+    started_at: dict[int, float] = {}
+    delays = dict.fromkeys(range(clusters), constants.CLUSTER_RESTART_DELAY)
+    restart_at: dict[int, float] = {}
+
+    def spawn(cluster_id: int):
+        env = os.environ | {
+            "SANTA_CLUSTER_ID": str(cluster_id),
+            "SANTA_SHARD_IDS": ",".join(map(str, ranges[cluster_id])),
+            "SANTA_SHARD_COUNT": str(shard_count),
+        }
+        processes[cluster_id] = subprocess.Popen([sys.executable, "-m", "super_secret_santa"], env=env)
+        started_at[cluster_id] = time.monotonic()
+        logger.info(f"Started cluster {cluster_id} (pid {processes[cluster_id].pid}) with shards {ranges[cluster_id]}")
+
+    def stop(*_):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, stop)
+    logger.info(f"Launching {clusters} clusters for {shard_count} shards")
+    for cluster_id in range(clusters):
+        spawn(cluster_id)
+
+    try:
+        while True:
+            time.sleep(1)
+            now = time.monotonic()
+            for cluster_id, process in processes.items():
+                if cluster_id in restart_at or process.poll() is None:
+                    continue
+                if now - started_at[cluster_id] > constants.CLUSTER_HEALTHY_UPTIME:
+                    delays[cluster_id] = constants.CLUSTER_RESTART_DELAY
+                logger.error(
+                    f"Cluster {cluster_id} exited with code {process.returncode}, "
+                    f"restarting it in {delays[cluster_id]}s"
+                )
+                restart_at[cluster_id] = now + delays[cluster_id]
+                delays[cluster_id] = min(2 * delays[cluster_id], constants.CLUSTER_MAX_RESTART_DELAY)
+            for cluster_id, at in list(restart_at.items()):
+                if at <= now:
+                    del restart_at[cluster_id]
+                    spawn(cluster_id)
+    except KeyboardInterrupt:
+        logger.info("Stopping the clusters")
+        for process in processes.values():
+            process.terminate()
+        for process in processes.values():
+            process.wait()
+
 
 if __name__ == "__main__":
-    bot.run(config.get("Discord", "token"))
+    token = config.get("Discord", "token")
+    clusters = config.getint("Discord", "clusters", fallback=1)
+    if clusters > 1 and SHARD_IDS is None:
+        launch(token, clusters)
+    else:
+        startup.run(token)
@@ -1,3 +1,26 @@
+import os
+
 import discord
 
-bot: discord.Bot = discord.Bot()
+from .config import config
+
+# set by the cluster launcher (see __main__) in each of its worker processes
+CLUSTER_ID = int(os.environ.get("SANTA_CLUSTER_ID", 0))
+SHARD_IDS = [int(shard) for shard in os.environ["SANTA_SHARD_IDS"].split(",")] if "SANTA_SHARD_IDS" in os.environ else None
+SHARD_COUNT = int(os.environ["SANTA_SHARD_COUNT"]) if "SANTA_SHARD_COUNT" in os.environ else None
+
+
+def _create_bot() -> discord.Bot | discord.AutoShardedBot:
+    if SHARD_IDS is not None:
+        # commands are the same for everyone, one cluster registering them is enough
+        return discord.AutoShardedBot(shard_ids=SHARD_IDS, shard_count=SHARD_COUNT, auto_sync_commands=CLUSTER_ID == 0)
+    match config.get("Discord", "shards", fallback=""):
+        case "":
+            return discord.Bot()
+        case "auto":
+            return discord.AutoShardedBot()
+        case shards:
+            return discord.AutoShardedBot(shard_count=int(shards))
+
+
+bot = _create_bot()
@@ -0,0 +1,58 @@
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+from time import monotonic
+
+MISSING = object()
+
+
+class TTLCache[K: Hashable, V]:
+    """Size-bounded LRU mapping whose entries expire `ttl` seconds after being stored."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[K, tuple[float, V]] = OrderedDict()
+
+    def get(self, key: K, default=MISSING) -> V:
+        entry = self._data.get(key)
+        if entry is None or entry[0] < monotonic():
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def peek(self, key: K, default=MISSING) -> V:
+        """Like `get`, without counting the lookup nor making the entry recently used."""
+        entry = self._data.get(key)
+        if entry is None or entry[0] < monotonic():
+            return default
+        return entry[1]
+
+    def set(self, key: K, value: V):
+        self._data[key] = (monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key: K):
+        self._data.pop(key, None)
+
+    def invalidate_where(self, predicate: Callable[[K], bool]):
+        for key in [key for key in self._data if predicate(key)]:
+            del self._data[key]
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
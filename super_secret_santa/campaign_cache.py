@@ -0,0 +1,169 @@
+import asyncio
+from collections.abc import Iterable
+from dataclasses import dataclass, field
+
+from . import constants, events, metrics
+from .cache import MISSING, TTLCache
+from .database import PREPARE, get_read_connection, mark_written
+
+
+@dataclass
+class CachedCampaign:
+    name: str
+    state: str
+    organizer_id: int | None
+    members: set[int] = field(default_factory=set)
+
+
+@dataclass(frozen=True)
+class Giftee:
+    guild_id: int
+    user_id: int
+    campaign_name: str
+
+
+# None is cached too: most guilds have no campaign, and clicking a stale button costs nothing then
+_campaigns: TTLCache[int, CachedCampaign | None] = TTLCache(constants.CAMPAIGN_CACHE_SIZE, constants.CAMPAIGN_CACHE_TTL)
+# the giftees of every user in started campaigns, they do not change until the campaign is deleted
+_giftees: TTLCache[int, list[Giftee]] = TTLCache(constants.CAMPAIGN_CACHE_SIZE, constants.CAMPAIGN_CACHE_TTL)
+_loading: dict[int, asyncio.Task] = {}
+# bumped on every write, so a load that started before it does not store what it read
+_generations: dict[int, int] = {}
+_epoch = 0  # bumped when everything is forgotten
+# read-your-writes key of every giftee lookup, as we do not know who takes part in a campaign started elsewhere
+_GIFTEES = "giftees"
+
+
+# the statements in capitals are also checked by benchmarks/query_plans.py
+LOAD_CAMPAIGN = """
+SELECT
+    c.name,
+    c.state,
+    (SELECT user_id FROM Memberships WHERE guild_id = c.guild_id AND is_organizer),
+    ARRAY(SELECT user_id FROM Memberships WHERE guild_id = c.guild_id)
+FROM Campaigns c
+WHERE c.guild_id = %s;
+"""
+
+
+async def _load(guild_id: int) -> CachedCampaign | None:
+    generation = (_epoch, _generations.get(guild_id, 0))
+    async with get_read_connection(guild_id) as conn:
+        cur = conn.cursor()
+        await cur.execute(
+            LOAD_CAMPAIGN,
+            (guild_id,),
+            prepare=PREPARE,
+            statement="load_campaign",
+        )
+        row = await cur.fetchone()
+    campaign = CachedCampaign(*row[:3], members=set(row[3])) if row else None
+    if (_epoch, _generations.get(guild_id, 0)) == generation:
+        _campaigns.set(guild_id, campaign)
+    return campaign
+
+
+async def get_campaign(guild_id: int) -> CachedCampaign | None:
+    """The campaign of a guild, None if there is none. Concurrent misses share one query."""
+    if (campaign := _campaigns.get(guild_id)) is not MISSING:
+        return campaign
+    if (task := _loading.get(guild_id)) is None:
+        task = _loading[guild_id] = asyncio.create_task(_load(guild_id))
+        task.add_done_callback(lambda _: _loading.pop(guild_id, None))
+    return await asyncio.shield(task)
+
+
+LOAD_GIFTEES = """
+SELECT m.guild_id, g.user_id, c.name
+FROM Memberships m
+INNER JOIN Giftees g ON m.giftee = g.id AND g.user_id IS NOT NULL
+INNER JOIN Campaigns c ON m.guild_id = c.guild_id AND c.state = 'started'
+WHERE m.user_id = %s
+ORDER BY m.guild_id;
+"""
+
+
+async def get_giftees(user_id: int) -> list[Giftee]:
+    """Whom `user_id` must get a gift for, in every started campaign they are part of."""
+    if (giftees := _giftees.get(user_id)) is not MISSING:
+        return giftees
+    async with get_read_connection(_GIFTEES) as conn:
+        cur = conn.cursor()
+        await cur.execute(
+            LOAD_GIFTEES,
+            (user_id,),
+            prepare=PREPARE,
+            statement="load_giftees",
+        )
+        giftees = [Giftee(*row) for row in await cur.fetchall()]
+    _giftees.set(user_id, giftees)
+    return giftees
+
+
+def _write(guild_id: int) -> CachedCampaign | None:
+    _generations[guild_id] = _generations.get(guild_id, 0) + 1
+    return _campaigns.peek(guild_id, None)
+
+
+# Write-through: called by the write paths once their transaction is committed
+
+
+def campaign_created(guild_id: int, name: str, organizer_id: int):
+    _write(guild_id)
+    _campaigns.set(guild_id, CachedCampaign(name, "awaiting", organizer_id, {organizer_id}))
+
+
+def campaign_deleted(guild_id: int):
+    _write(guild_id)
+    _campaigns.set(guild_id, None)
+    _giftees.clear()  # we do not know whose giftees were there, and deletes are rare
+    mark_written(_GIFTEES)
+
+
+def campaign_started(guild_id: int, givers: Iterable[int]):
+    if (campaign := _write(guild_id)) is not None:
+        campaign.state = "started"
+    for giver in givers:
+        _giftees.invalidate(giver)
+    mark_written(_GIFTEES)
+
+
+def member_joined(guild_id: int, user_id: int):
+    if (campaign := _write(guild_id)) is not None:
+        campaign.members.add(user_id)
+
+
+def member_left(guild_id: int, user_id: int):
+    if (campaign := _write(guild_id)) is not None:
+        campaign.members.discard(user_id)
+
+
+def invalidate(guild_id: int | None):
+    """Forget a guild's campaign, e.g. when it was changed by another process, or everything with None."""
+    global _epoch
+    if guild_id is None:
+        _epoch += 1
+        _campaigns.clear()
+        return
+    _write(guild_id)
+    _campaigns.invalidate(guild_id)
+
+
+def _campaign_event(guild_id: int | None):
+    invalidate(guild_id)
+    # we do not know who takes part in a campaign started or deleted elsewhere, and that is rare
+    _giftees.clear()
+    mark_written(_GIFTEES)
+
+
+events.subscribe(events.Event.CAMPAIGN, _campaign_event)
+events.subscribe(events.Event.MEMBERS, invalidate)
+
+
+def hit_rates() -> tuple[float, float]:
+    """Hit rates of the campaign and the giftee caches."""
+    return _campaigns.hit_rate, _giftees.hit_rate
+
+
+metrics.Gauge("santa_campaign_cache_hit_ratio", "Hit rate of the campaign cache.", lambda: _campaigns.hit_rate)
+metrics.Gauge("santa_giftee_cache_hit_ratio", "Hit rate of the giftee cache.", lambda: _giftees.hit_rate)
@@ -0,0 +1,94 @@
+import asyncio
+from collections import deque
+from collections.abc import Sequence
+from time import monotonic
+
+import discord
+from loguru import logger
+
+from . import campaign_cache, constants
+
+# per guild: the campaign message to edit next, the edit scheduled for it, when it was last edited
+_messages: dict[int, discord.Message] = {}
+_scheduled: dict[int, asyncio.Task] = {}
+_last_edit: dict[int, float] = {}
+# display names of the latest joiners, most recent first, forgotten on restart
+_recent: dict[int, deque[str]] = {}
+
+
+def content(
+    name: str, organizer_id: int | None, participants: int = 1, recent: Sequence[str] = (), started: bool = False
+) -> str:
+    """Text of the campaign message, the one with the buttons."""
+    text = f"Super Secret Santa campaign: **{name}**\nCreated by <@{organizer_id}>!"
+    if started:
+        return text + f"\n🎁 Started with {participants} participants!"
+    text += f"\n🎅 {participants} participant{"" if participants == 1 else "s"}"
+    if recent:
+        # names, not mentions: nobody should be pinged by an edit
+        text += " · Recently joined: " + ", ".join(discord.utils.escape_markdown(joiner) for joiner in recent)
+    return text
+
+
+def _schedule(guild_id: int, message: discord.Message):
+    _messages[guild_id] = message
+    if guild_id in _scheduled:
+        return  # the scheduled edit will show this change too
+    # the first click of a burst waits a bit too, so the clicks right after it make the same edit
+    delay = max(constants.CAMPAIGN_MESSAGE_EDIT_INTERVAL - (monotonic() - _last_edit.get(guild_id, 0)), 1)
+    _scheduled[guild_id] = asyncio.create_task(_edit(guild_id, delay))
+
+
+async def _edit(guild_id: int, delay: float):
+    try:
+        await asyncio.sleep(delay)
+    finally:
+        if _scheduled.get(guild_id) is asyncio.current_task():
+            del _scheduled[guild_id]
+    if (message := _messages.pop(guild_id, None)) is None:
+        return
+    _last_edit[guild_id] = monotonic()
+    try:
+        campaign = await campaign_cache.get_campaign(guild_id)
+        if campaign is None:
+            return
+        await message.edit(
+            content=content(
+                campaign.name,
+                campaign.organizer_id,
+                len(campaign.members),
+                list(_recent.get(guild_id, ())),
+                campaign.state == "started",
+            )
+        )
+    except Exception as e:
+        logger.warning(f"Could not update the campaign message of guild {guild_id}: {e}")
+
+
+def member_joined(guild_id: int, message: discord.Message, name: str):
+    """Count a new participant on `message` and show their name, with the next edit of this guild's message."""
+    recent = _recent.setdefault(guild_id, deque(maxlen=constants.RECENT_JOINERS))
+    if name in recent:
+        recent.remove(name)
+    recent.appendleft(name)
+    _schedule(guild_id, message)
+
+
+def member_left(guild_id: int, message: discord.Message, name: str):
+    if (recent := _recent.get(guild_id)) is not None and name in recent:
+        recent.remove(name)
+    _schedule(guild_id, message)
+
+
+def campaign_started(guild_id: int, message: discord.Message):
+    _recent.pop(guild_id, None)
+    _schedule(guild_id, message)
+
+
+def forget(guild_id: int):
+    """Drop everything about a deleted campaign, including its pending edit."""
+    if (task := _scheduled.pop(guild_id, None)) is not None:
+        task.cancel()
+    _messages.pop(guild_id, None)
+    _recent.pop(guild_id, None)
+    _last_edit.pop(guild_id, None)
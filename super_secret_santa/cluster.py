@@ -0,0 +1,67 @@
+import asyncio
+from dataclasses import dataclass
+
+from loguru import logger
+
+from . import constants
+from .bot import CLUSTER_ID, bot
+from .database import get_connection
+
+_worker: asyncio.Task | None = None
+
+
+@dataclass
+class ClusterTotals:
+    clusters: int
+    shards: int
+    guilds: int
+
+
+def shard_ids() -> list[int]:
+    if (shards := getattr(bot, "shards", None)) is not None:
+        return sorted(shards)
+    return [0]
+
+
+async def report():
+    """Record this cluster's shards and guild count for the others to see."""
+    async with get_connection() as conn:
+        await conn.execute(
+            """
+            INSERT INTO ClusterStatus (cluster_id, shard_ids, guild_count) VALUES (%s, %s, %s)
+            ON CONFLICT (cluster_id) DO UPDATE
+            SET shard_ids = EXCLUDED.shard_ids, guild_count = EXCLUDED.guild_count, updated_at = CURRENT_TIMESTAMP;
+            """,
+            (CLUSTER_ID, shard_ids(), len(bot.guilds)),
+        )
+
+
+async def totals() -> ClusterTotals:
+    """Sum up the clusters that reported recently, this one always counting with its current figures."""
+    await report()
+    async with get_connection() as conn:
+        cur = await conn.execute(
+            """
+            SELECT count(*), coalesce(sum(cardinality(shard_ids)), 0), coalesce(sum(guild_count), 0)
+            FROM ClusterStatus
+            WHERE updated_at > CURRENT_TIMESTAMP - make_interval(secs => %s);
+            """,
+            (3 * constants.CLUSTER_HEARTBEAT_INTERVAL,),
+        )
+        return ClusterTotals(*await cur.fetchone())
+
+
+async def _run():
+    while True:
+        try:
+            await report()
+        except Exception as e:
+            logger.error(f"Could not report the status of cluster {CLUSTER_ID}:\n{e}")
+        await asyncio.sleep(constants.CLUSTER_HEARTBEAT_INTERVAL)
+
+
+def start():
+    """Start reporting the status of this cluster periodically."""
+    global _worker
+    if _worker is None or _worker.done():
+        _worker = asyncio.create_task(_run())
@@ -1,21 +1,46 @@
+import discord
 import psycopg.errors
 from discord.commands.context import ApplicationContext
-from discord import File as DiscordFile
+from discord.ext.pages import Paginator
+from discord import File as DiscordFile, Member
 from loguru import logger
 from datetime import datetime
-from tempfile import NamedTemporaryFile
-
-from . import constants
+from io import BytesIO
+
+from . import (
+    campaign_cache,
+    campaign_message,
+    cluster,
+    constants,
+    database,
+    events,
+    metrics,
+    pdf_cache,
+    rendering,
+    resolver,
+)
 from .bot import bot
 from .views import CampaignView
 from .database import get_connection
-from .pdf import generate_pdf
+
+
+# the statements in capitals are also checked by benchmarks/query_plans.py
+LIST_EXCLUSIONS = "SELECT giver_id, giftee_id FROM Exclusions WHERE guild_id = %s ORDER BY giver_id, giftee_id;"
+
+PDF_ASSIGNMENTS = """
+SELECT m.user_id, g.user_id
+FROM Memberships m
+INNER JOIN Giftees g ON m.giftee = g.id
+WHERE m.guild_id = %s
+ORDER BY m.user_id;
+"""
 
 
 def setup():
     santa_command_group = bot.create_group("santa", "Secret Santa commands")
 
     @santa_command_group.command()
+    @metrics.timed()
     async def create(ctx: ApplicationContext, campaign_name: str):
         """Create a new Secret Santa campaign"""
         await ctx.defer(ephemeral=True)
@@ -28,7 +53,6 @@ def setup():
         async with get_connection() as conn:
             cur = conn.cursor()
             try:
-                await cur.advisory_lock(ctx.guild.id)
                 await cur.execute(
                     """
                     INSERT INTO Campaigns (guild_id, name)
@@ -50,9 +74,10 @@ def setup():
                         ctx.guild.id,
                     ),
                 )
+                await events.publish(cur, ctx.guild.id, events.Event.CAMPAIGN)
 
                 await ctx.channel.send(
-                    f"Super Secret Santa campaign: **{campaign_name}**\nCreated by {ctx.author.mention}!",
+                    campaign_message.content(campaign_name, ctx.author.id),
                     view=CampaignView(),
                 )
                 logger.info(f"User {ctx.author.global_name} created the campaign {campaign_name}")
@@ -64,7 +89,10 @@ def setup():
                 )
                 return
 
+        campaign_cache.campaign_created(ctx.guild.id, campaign_name, ctx.author.id)
+
     @santa_command_group.command()
+    @metrics.timed()
     async def delete(ctx: ApplicationContext):
         """Delete the current Secret Santa campaign on the server"""
         await ctx.defer(ephemeral=True)
@@ -74,25 +102,37 @@ def setup():
                 delete_after=constants.DELETE_AFTER_DELAY,
             )
             return
-        async with get_connection() as conn:
-            cur = conn.cursor()
-            await cur.advisory_lock(ctx.guild.id)
-            await cur.execute(
-                "SELECT is_organizer FROM Memberships WHERE user_id = %s AND guild_id = %s AND is_organizer = TRUE;",
-                (ctx.author.id, ctx.guild.id),
+        # the cache only rejects early, the statement checks the organizer itself
+        campaign = await campaign_cache.get_campaign(ctx.guild.id)
+        deleted = False
+        if campaign is not None and campaign.organizer_id == ctx.author.id:
+            async with get_connection() as conn:
+                cur = conn.cursor()
+                await cur.execute(
+                    """
+                    DELETE FROM Campaigns
+                    WHERE guild_id = %(guild_id)s
+                      AND EXISTS (
+                          SELECT 1 FROM Memberships
+                          WHERE guild_id = %(guild_id)s AND user_id = %(user_id)s AND is_organizer
+                      );
+                    """,
+                    {"guild_id": ctx.guild.id, "user_id": ctx.author.id},
+                )  # cascade delete of Memberships and PdfCache
+                if deleted := cur.rowcount > 0:
+                    await events.publish(cur, ctx.guild.id, events.Event.CAMPAIGN)
+            if not deleted:
+                campaign_cache.invalidate(ctx.guild.id)  # it was stale
+        if not deleted:
+            await ctx.followup.send(
+                "You can only delete campaigns you have organized!",
+                delete_after=constants.DELETE_AFTER_DELAY,
             )
-            is_organizer = await cur.fetchone()
-            if not is_organizer:
-                await ctx.followup.send(
-                    "You can only delete campaigns you have organized!",
-                    delete_after=constants.DELETE_AFTER_DELAY,
-                )
-                return
+            return
 
-            await cur.execute(
-                "DELETE FROM Campaigns WHERE guild_id = %s;",
-                (ctx.guild.id,),
-            )  # cascade delete of Memberships
+        resolver.invalidate_guild(ctx.guild.id)
+        campaign_cache.campaign_deleted(ctx.guild.id)
+        campaign_message.forget(ctx.guild.id)
 
         await ctx.followup.send(
             "The campaign has been deleted!",
@@ -100,7 +140,136 @@ def setup():
         )
         logger.info(f"User {ctx.author.global_name} deleted the campaign")
 
+    async def update_exclusion(ctx: ApplicationContext, giver: Member, giftee: Member, both_ways: bool, query: str):
+        await ctx.defer(ephemeral=True)
+        if not ctx.guild:
+            await ctx.followup.send(
+                "This command can only be used in a server!",
+                delete_after=constants.DELETE_AFTER_DELAY,
+            )
+            return False
+        if giver.id == giftee.id:
+            await ctx.followup.send(
+                "Nobody can draw themselves anyway!",
+                delete_after=constants.DELETE_AFTER_DELAY,
+            )
+            return False
+        # the cache only rejects early, `query` checks the organizer itself
+        campaign = await campaign_cache.get_campaign(ctx.guild.id)
+        authorized = False
+        if campaign is not None and campaign.organizer_id == ctx.author.id:
+            async with get_connection() as conn:
+                cur = conn.cursor()
+                pairs = [(giver.id, giftee.id)] + ([(giftee.id, giver.id)] if both_ways else [])
+                await cur.execute(
+                    query,
+                    {
+                        "guild_id": ctx.guild.id,
+                        "user_id": ctx.author.id,
+                        "givers": [a for a, _ in pairs],
+                        "giftees": [b for _, b in pairs],
+                    },
+                )
+                (authorized,) = await cur.fetchone()
+                if authorized:
+                    await events.publish(cur, ctx.guild.id, events.Event.EXCLUSIONS)
+            if not authorized:
+                campaign_cache.invalidate(ctx.guild.id)  # it was stale
+        if not authorized:
+            await ctx.followup.send(
+                "Only the organizer of the campaign can manage exclusions!",
+                delete_after=constants.DELETE_AFTER_DELAY,
+            )
+        return authorized
+
+    @santa_command_group.command()
+    @metrics.timed()
+    async def exclude(ctx: ApplicationContext, giver: Member, giftee: Member, both_ways: bool = True):
+        """Only for the organizer: prevent a member from drawing another one (e.g. a couple)"""
+        if await update_exclusion(
+            ctx,
+            giver,
+            giftee,
+            both_ways,
+            """
+            WITH organizer AS (
+                SELECT 1 FROM Memberships
+                WHERE guild_id = %(guild_id)s AND user_id = %(user_id)s AND is_organizer
+            ), inserted AS (
+                INSERT INTO Exclusions (guild_id, giver_id, giftee_id)
+                SELECT %(guild_id)s, pairs.giver_id, pairs.giftee_id
+                FROM organizer, unnest(%(givers)s::BIGINT[], %(giftees)s::BIGINT[]) AS pairs (giver_id, giftee_id)
+                ON CONFLICT DO NOTHING
+            )
+            SELECT EXISTS (SELECT 1 FROM organizer);
+            """,
+        ):
+            await ctx.followup.send(
+                f"{giver.mention} will not draw {giftee.mention}{" and vice versa" if both_ways else ""}!",
+                delete_after=constants.DELETE_AFTER_DELAY,
+            )
+            logger.info(f"User {ctx.author.global_name} excluded {giver.id} -> {giftee.id}")
+
+    @santa_command_group.command()
+    @metrics.timed()
+    async def include(ctx: ApplicationContext, giver: Member, giftee: Member, both_ways: bool = True):
+        """Only for the organizer: remove an exclusion added with /santa exclude"""
+        if await update_exclusion(
+            ctx,
+            giver,
+            giftee,
+            both_ways,
+            """
+            WITH organizer AS (
+                SELECT 1 FROM Memberships
+                WHERE guild_id = %(guild_id)s AND user_id = %(user_id)s AND is_organizer
+            ), deleted AS (
+                DELETE FROM Exclusions e
+                USING organizer, unnest(%(givers)s::BIGINT[], %(giftees)s::BIGINT[]) AS pairs (giver_id, giftee_id)
+                WHERE e.guild_id = %(guild_id)s AND e.giver_id = pairs.giver_id AND e.giftee_id = pairs.giftee_id
+            )
+            SELECT EXISTS (SELECT 1 FROM organizer);
+            """,
+        ):
+            await ctx.followup.send(
+                f"{giver.mention} may draw {giftee.mention}{" and vice versa" if both_ways else ""} again!",
+                delete_after=constants.DELETE_AFTER_DELAY,
+            )
+            logger.info(f"User {ctx.author.global_name} removed the exclusion {giver.id} -> {giftee.id}")
+
     @santa_command_group.command()
+    @metrics.timed()
+    async def exclusions(ctx: ApplicationContext):
+        """List the pairs that cannot be drawn in the campaign"""
+        await ctx.defer(ephemeral=True)
+        if not ctx.guild:
+            await ctx.followup.send(
+                "This command can only be used in a server!",
+                delete_after=constants.DELETE_AFTER_DELAY,
+            )
+            return
+
+        async with get_connection() as conn:
+            cur = conn.cursor()
+            await cur.execute(
+                LIST_EXCLUSIONS,
+                (ctx.guild.id,),
+            )
+            pairs = await cur.fetchall()
+
+        if not pairs:
+            await ctx.followup.send(
+                "There are no exclusions in the campaign!",
+                delete_after=constants.DELETE_AFTER_DELAY,
+            )
+            return
+
+        message = "These members will not draw each other:\n"
+        message += "\n".join(f"* <@{giver}> -> <@{giftee}>" for giver, giftee in pairs)
+        await ctx.followup.send(message, delete_after=None)
+
+    @santa_command_group.command()
+    @metrics.timed()
     async def message(ctx: ApplicationContext, message: str):
         """Send a message to your giftee, whom you must get a gift for (NOT your Secret Santa)"""
         if ctx.guild is not None:
@@ -114,61 +283,55 @@ def setup():
         await ctx.defer(ephemeral=True)
         message = str(message).upper()
         # we need to find out all started campaigns the Member is part of, where `giftee` is not NULL
-        async with get_connection() as conn:
-            cur = conn.cursor()
-
-            await cur.execute(
-                """
-                SELECT m.guild_id, g.user_id, c.name
-                FROM Memberships m
-                INNER JOIN Giftees g ON m.giftee = g.id AND g.user_id IS NOT NULL
-                INNER JOIN Campaigns c ON m.guild_id = c.guild_id AND c.state = 'started'
-                WHERE m.user_id = %s;
-                """,
-                (ctx.author.id,),
-            )
-
-            campaigns = await cur.fetchall()
-            match len(campaigns):
-                case 0:
-                    await ctx.followup.send(
-                        "You are not part of any started campaigns!",
-                        delete_after=constants.DELETE_AFTER_DELAY,
-                    )
-                    return
-                case 1:
-                    campaign = campaigns[0]
-                case _:
-                    message_to_send = "Please select one of the campaigns to send the message to with `/santa messagex <number> <message>`:\n"
-                    for number, campaign in enumerate(campaigns, start=1):
-                        message_to_send += f"{number}. {campaign[2]} ({(await bot.fetch_user(campaign[1])).mention})\n"
-                    ctx.followup.send(
-                        message_to_send,
-                        delete_after=constants.DELETE_AFTER_DELAY,
-                    )
-                    return
-
-            await ctx.followup.send(
-                f"Sending message to {((await bot.fetch_user(campaign[1])).mention)} in the campaign **{campaign[2]}**...",
-            )
-
-            # send the message to the user
-            user = await bot.fetch_user(campaign[1])
-            try:
-                await user.send(f"Your Secret Santa in campaign **{campaign[2]}** has sent you a message:\n{message}")
+        campaigns = await campaign_cache.get_giftees(ctx.author.id)
+        match len(campaigns):
+            case 0:
                 await ctx.followup.send(
-                    "Message sent successfully!",
+                    "You are not part of any started campaigns!",
                     delete_after=constants.DELETE_AFTER_DELAY,
                 )
-                logger.debug(f"Sent message to {user.id} ({user.global_name})")
-            except Exception:
+                return
+            case 1:
+                campaign = campaigns[0]
+            case _:
+                message_to_send = "Please select one of the campaigns to send the message to with `/santa messagex <number> <message>`:\n"
+                for number, campaign in enumerate(campaigns, start=1):
+                    message_to_send += f"{number}. {campaign.campaign_name} (<@{campaign.user_id}>)\n"
                 ctx.followup.send(
-                    "Message could not be sent!",
+                    message_to_send,
                     delete_after=constants.DELETE_AFTER_DELAY,
                 )
+                return
+
+        user = await resolver.get_user(campaign.user_id)
+        if user is None:
+            await ctx.followup.send(
+                "Your giftee could not be found!",
+                delete_after=constants.DELETE_AFTER_DELAY,
+            )
+            return
+
+        await ctx.followup.send(
+            f"Sending message to {user.mention} in the campaign **{campaign.campaign_name}**...",
+        )
+
+        # send the message to the user
+        try:
+            await user.send(f"Your Secret Santa in campaign **{campaign.campaign_name}** has sent you a message:\n{message}")
+            await ctx.followup.send(
+                "Message sent successfully!",
+                delete_after=constants.DELETE_AFTER_DELAY,
+            )
+            logger.debug(f"Sent message to {user.id} ({user.global_name})")
+        except Exception:
+            ctx.followup.send(
+                "Message could not be sent!",
+                delete_after=constants.DELETE_AFTER_DELAY,
+            )
 
     # TODO: merge message and messagex
     @santa_command_group.command()
+    @metrics.timed()
     async def messagex(ctx: ApplicationContext, number: int, message: str):
         """Send a message to your giftee, whom you must get a gift for (NOT your Secret Santa)"""
         if ctx.guild is not None:
@@ -182,51 +345,46 @@ def setup():
         await ctx.defer(ephemeral=True)
         message = str(message).upper()
         # we need to find out all started campaigns the Member is part of, where `giftee` is not NULL
-        async with get_connection() as conn:
-            cur = conn.cursor()
-            await cur.execute(
-                """
-                SELECT m.guild_id, g.user_id, c.name
-                FROM Memberships m
-                INNER JOIN Giftees g ON m.giftee = g.id AND g.user_id IS NOT NULL
-                INNER JOIN Campaigns c ON m.guild_id = c.guild_id AND c.state = 'started'
-                WHERE m.user_id = %s;
-                """,
-                (ctx.author.id,),
+        campaigns = await campaign_cache.get_giftees(ctx.author.id)
+        try:
+            campaign = campaigns[number - 1]
+        except IndexError:
+            await ctx.followup.send(
+                "Invalid number!",
+                delete_after=constants.DELETE_AFTER_DELAY,
             )
+            return
 
-            campaigns = await cur.fetchall()
-            try:
-                campaign = campaigns[number - 1]
-            except IndexError:
-                await ctx.followup.send(
-                    "Invalid number!",
-                    delete_after=constants.DELETE_AFTER_DELAY,
-                )
-                return
-
+        user = await resolver.get_user(campaign.user_id)
+        if user is None:
             await ctx.followup.send(
-                f"Sending message to {((await bot.fetch_user(campaign[1])).mention)} in the campaign **{campaign[2]}**...",
+                "Your giftee could not be found!",
                 delete_after=constants.DELETE_AFTER_DELAY,
             )
+            return
 
-            # send the message to the user
-            user = await bot.fetch_user(campaign[1])
-            try:
-                await user.send(f"Your Secret Santa in campaign **{campaign[2]}** has sent you a message:\n{message}")
-                await ctx.followup.send(
-                    "Message sent successfully!",
-                    delete_after=constants.DELETE_AFTER_DELAY,
-                )
-                logger.debug(f"Sent message to {user.id} ({user.global_name})")
+        await ctx.followup.send(
+            f"Sending message to {user.mention} in the campaign **{campaign.campaign_name}**...",
+            delete_after=constants.DELETE_AFTER_DELAY,
+        )
 
-            except Exception:
-                await ctx.followup.send(
-                    "Message could not be sent!",
-                    delete_after=constants.DELETE_AFTER_DELAY,
-                )
+        # send the message to the user
+        try:
+            await user.send(f"Your Secret Santa in campaign **{campaign.campaign_name}** has sent you a message:\n{message}")
+            await ctx.followup.send(
+                "Message sent successfully!",
+                delete_after=constants.DELETE_AFTER_DELAY,
+            )
+            logger.debug(f"Sent message to {user.id} ({user.global_name})")
+
+        except Exception:
+            await ctx.followup.send(
+                "Message could not be sent!",
+                delete_after=constants.DELETE_AFTER_DELAY,
+            )
 
     @santa_command_group.command()
+    @metrics.timed()
     async def list(ctx: ApplicationContext):
         """List all members of the campaign"""
         await ctx.defer(ephemeral=True)
@@ -237,50 +395,64 @@ def setup():
             )
             return
 
-        async with get_connection() as conn:
-            time_code = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            cur = conn.cursor()
-            await cur.execute(
-                """
-                SELECT user_id
-                FROM Memberships
-                WHERE guild_id = %s;
-                """,
-                (ctx.guild.id,),
+        time_code = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        campaign = await campaign_cache.get_campaign(ctx.guild.id)
+        if campaign is None or not campaign.members:
+            await ctx.followup.send(
+                "There are no members in the campaign!",
+                delete_after=constants.DELETE_AFTER_DELAY,
             )
-            members = await cur.fetchall()
-
-            if not members:
-                await ctx.followup.send(
-                    "There are no members in the campaign!",
-                    delete_after=constants.DELETE_AFTER_DELAY,
-                )
-                # This should not really happen
-                return
-
-            message = f"Members of the campaign as of {time_code}:\n"
-
-            guild_members = [(await ctx.guild.fetch_member(member[0])) for member in members]
+            return
 
-            member_names = sorted(
-                (member.display_name if member.display_name else "Unknown member") for member in guild_members
-            )
+        guild_members = await resolver.get_members(ctx.guild, campaign.members)
+        member_names = sorted(
+            (member.display_name if member and member.display_name else "Unknown member")
+            for member in guild_members.values()
+        )
 
-            message += "\n".join([f"* {name}" for name in member_names])
+        header = f"Members of the campaign as of {time_code} ({len(member_names)}):\n"
+        page_size = constants.LIST_PAGE_SIZE
+        messages = [
+            header + "\n".join(f"* {name}" for name in member_names[i : i + page_size])
+            for i in range(0, len(member_names), page_size)
+        ]
 
-            await ctx.followup.send(message, delete_after=None)  # (this takes longer to read than other messages)
+        if len(messages) == 1:
+            await ctx.followup.send(messages[0], delete_after=None)  # (this takes longer to read than other messages)
+        else:
+            await Paginator(pages=messages).respond(ctx.interaction, ephemeral=True)
 
     @santa_command_group.command()
+    @metrics.timed()
     async def status(ctx: ApplicationContext):
         """Show the bot status on the channel"""
         await ctx.respond("Showing statistics now...")
-        server_count = len(bot.guilds)
+        totals = await cluster.totals()
+        server_count = totals.guilds
         current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        pool = database.pool_stats()
+        replica = database.replica_pool_stats()
+        campaign_rate, giftee_rate = campaign_cache.hit_rates()
         await ctx.channel.send(
-            f"Bot is currently running on {server_count} server{"" if server_count == 1 else "s"}\nCurrent time: {current_time}",
+            f"Bot is currently running on {server_count} server{"" if server_count == 1 else "s"}"
+            + (f" across {totals.clusters} clusters of {totals.shards} shards" if totals.clusters > 1 else "")
+            + f"\nCurrent time: {current_time}\n"
+            f"User lookups: {resolver.stats.gateway_hits} gateway cache hits, {resolver.stats.cache_hits} cache hits, "
+            f"{resolver.stats.coalesced} coalesced, {resolver.stats.fetches} fetches\n"
+            f"Campaign cache hit rates: {campaign_rate:.0%} for campaigns, {giftee_rate:.0%} for giftees\n"
+            f"Database connections: {pool['pool_size'] - pool['pool_available']}/{pool['pool_size']} in use "
+            f"(max {pool['pool_max']}), {pool['requests_waiting']} requests waiting, "
+            f"acquired in {database.stats.mean_acquire_seconds * 1000:.1f} ms on average "
+            f"({database.stats.max_acquire_seconds * 1000:.1f} ms at most), {pool.get('requests_errors', 0)} failed"
+            + (
+                f"\nReplica connections: {replica['pool_size'] - replica['pool_available']}/{replica['pool_size']} in use"
+                if replica
+                else ""
+            ),
         )
 
     @santa_command_group.command()
+    @metrics.timed()
     async def pdf(ctx: ApplicationContext):
         """Only for the organizer: generate a PDF with all the gift QR codes"""
         # we must send the PDF in a DM to the organizer
@@ -294,59 +466,90 @@ def setup():
 
         await ctx.defer(ephemeral=True)
 
-        async with get_connection() as conn:
-            cur = conn.cursor()
-            await cur.execute(
-                "SELECT is_organizer FROM Memberships WHERE user_id = %s AND guild_id = %s AND is_organizer = TRUE;",
-                (ctx.author.id, ctx.guild.id),
+        campaign = await campaign_cache.get_campaign(ctx.guild.id)
+        if campaign is None or campaign.organizer_id != ctx.author.id:
+            await ctx.followup.send(
+                "You can only generate a PDF if you are the organizer of the campaign!",
+                ephemeral=True,
+                delete_after=constants.DELETE_AFTER_DELAY,
             )
+            return
+        campaign_name = campaign.name
 
-            is_organizer = await cur.fetchone()
-            if not is_organizer:
-                await ctx.followup.send(
-                    "You can only generate a PDF if you are the organizer of the campaign!",
-                    ephemeral=True,
-                    delete_after=constants.DELETE_AFTER_DELAY,
-                )
-                return
-
+        async with database.get_read_connection(ctx.guild.id) as conn:
+            cur = conn.cursor()
             await cur.execute(
-                """
-                SELECT m.user_id, g.user_id
-                FROM Memberships m
-                INNER JOIN Giftees g ON m.giftee = g.id
-                WHERE m.guild_id = %s;
-                """,
+                PDF_ASSIGNMENTS,
                 (ctx.guild.id,),
             )
             data = await cur.fetchall()
-
-            # we need the campaign name
-            await cur.execute(
-                "SELECT name FROM Campaigns WHERE guild_id = %s;",
-                (ctx.guild.id,),
+        if not data:
+            await ctx.followup.send(
+                "The campaign has not started yet, there are no assignments to print!",
+                ephemeral=True,
+                delete_after=constants.DELETE_AFTER_DELAY,
             )
-            campaign_name = (await cur.fetchone())[0]
+            return
 
-            data_list = [((await ctx.guild.fetch_member(member[0])).display_name, member[1]) for member in data]
+        members = await resolver.get_members(ctx.guild, (giver for giver, _ in data))
+        data_list = [
+            (members[giver].display_name if members[giver] else "Unknown member", giftee) for giver, giftee in data
+        ]
 
-            with NamedTemporaryFile(suffix=".pdf") as output_pdf:
+        async def on_queued(waiting: int):
+            await ctx.followup.send(
+                f"Many PDFs are being generated right now, yours is queued behind {waiting} other{"" if waiting == 1 else "s"}...",
+                ephemeral=True,
+                delete_after=constants.DELETE_AFTER_DELAY,
+            )
+
+        async def send_part(number: int, part: bytes):
+            await ctx.author.send(
+                f"PDF with the QR codes for the campaign **{campaign_name}**"
+                + (f" (part {number})" if number > 1 else ""),
+                file=DiscordFile(BytesIO(part), filename=f"super-secret-santa-{number}.pdf"),
+            )
+            if number == 1:
                 await ctx.followup.send(
-                    "Generating PDF with QR codes...",
+                    "PDF generated! Check your DMs",
                     ephemeral=True,
                     delete_after=constants.DELETE_AFTER_DELAY,
                 )
 
-                generate_pdf(data_list, output_pdf.name)
+        # assignments never change once started, so the PDF only changes if someone changes their name
+        digest = pdf_cache.cache_key(data_list)
+        part_count = sent = 0
+        try:
+            try:
+                async for part in pdf_cache.cached_parts(ctx.guild.id, digest):
+                    sent += 1
+                    await send_part(sent, part)
+                if sent:
+                    logger.info(f"Sent cached PDF to {ctx.author.global_name}")
+                    return
+            except pdf_cache.PartMissing as e:
+                # the same digest renders the same parts: only send the ones after those already sent
+                logger.warning(f"{e} for guild {ctx.guild.id}, rendering it again")
 
+            if not sent:
                 await ctx.followup.send(
-                    "PDF generated! Check your DMs",
+                    "Generating PDF with QR codes...",
                     ephemeral=True,
                     delete_after=constants.DELETE_AFTER_DELAY,
                 )
+            async for part in rendering.render_parts(data_list, on_queued=on_queued):
+                part_count += 1
+                await pdf_cache.store_part(ctx.guild.id, digest, part_count, part)
+                if part_count > sent:
+                    await send_part(part_count, part)
+            await pdf_cache.mark_complete(ctx.guild.id, digest, part_count)
+        except discord.HTTPException as e:
+            logger.error(f"Could not send part {max(part_count, sent)} of the PDF to {ctx.author.global_name}:\n{e}")
+            await ctx.followup.send(
+                "The PDF could not be sent! Make sure you accept DMs from this server.",
+                ephemeral=True,
+                delete_after=constants.DELETE_AFTER_DELAY,
+            )
+            return
 
-                await ctx.author.send(
-                    f"PDF with the QR codes for the campaign **{campaign_name}**", file=DiscordFile(output_pdf.name)
-                )
-
-            logger.info(f"Sent PDF to {ctx.author.global_name}")
+        logger.info(f"Sent PDF to {ctx.author.global_name}")
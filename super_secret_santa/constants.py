@@ -1,3 +1,50 @@
 DELETE_AFTER_DELAY = 5
 REQUIRED_PERMISSIONS = "1143915147611200"
 REQUIRED_SCOPES = "applications.commands"
+
+# Direct message dispatching (py-cord already honours per-route and global buckets,
+# this keeps us well below them so a large campaign does not trip the DM spam filter)
+DM_WORKER_COUNT = 4
+DM_SEND_RATE = 5  # messages per second, shared by every guild
+DM_PROGRESS_INTERVAL = 2  # seconds between progress updates sent to the organizer
+USER_FETCH_CONCURRENCY = 8
+
+# Cache of resolved Discord users and members
+RESOLVER_CACHE_SIZE = 10_000
+RESOLVER_CACHE_TTL = 15 * 60  # seconds
+MEMBER_CHUNK_SIZE = 100  # most user IDs Discord accepts in one gateway member request
+LIST_PAGE_SIZE = 25  # members per page of /santa list
+
+ASSIGNMENT_TIME_BUDGET = 2  # seconds to find an assignment satisfying the exclusions
+
+# Durable DM outbox
+OUTBOX_BATCH_SIZE = 100
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_RETRY_DELAY = 30  # seconds, doubled after every failed attempt
+OUTBOX_POLL_INTERVAL = 60  # seconds between scans for messages due for a retry
+OUTBOX_LEASE = 60  # seconds claimed messages are reserved for, renewed until they are all sent
+
+# Advisory locks use the two-key form, the first key is always ours so they never collide with
+# other applications sharing the database (single-key locks live in a separate keyspace anyway)
+ADVISORY_LOCK_NAMESPACE = 0x53535300  # "SSS\0"
+MIGRATIONS_LOCK = 1
+
+# Clusters of shards, see __main__
+CLUSTER_HEARTBEAT_INTERVAL = 30  # seconds between status updates of every cluster
+CLUSTER_RESTART_DELAY = 5  # seconds before restarting a crashed cluster, doubled after each crash
+CLUSTER_MAX_RESTART_DELAY = 5 * 60
+CLUSTER_HEALTHY_UPTIME = 10 * 60  # a cluster up for this long is healthy again, its delay is reset
+
+# Cache invalidation events between processes
+EVENT_COALESCE_DELAY = 0.1  # seconds events are gathered for, so a burst invalidates each guild once
+EVENT_RECONNECT_DELAY = 5
+
+# Cache of campaign state, members and giftees, kept up to date by the write paths and events
+CAMPAIGN_CACHE_SIZE = 10_000
+CAMPAIGN_CACHE_TTL = 10 * 60  # seconds
+
+WRITTEN_KEYS_LIMIT = 10_000  # recently written guilds and users tracked before expired ones are dropped
+
+# Live participant count on the campaign message
+CAMPAIGN_MESSAGE_EDIT_INTERVAL = 3  # seconds between edits of one message, well below Discord's edit limits
+RECENT_JOINERS = 5  # names on the "recently joined" line
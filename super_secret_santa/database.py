@@ -1,23 +1,206 @@
+from collections.abc import AsyncIterator
+from contextlib import AbstractAsyncContextManager, asynccontextmanager
+from dataclasses import dataclass
+from enum import StrEnum
+from time import monotonic
+
 import psycopg
 import psycopg_pool
 from psycopg import AsyncCursor
 
+from . import constants, metrics
 from .config import config
 
 
-async def create_santa_assignment(cur: AsyncCursor, guild_id: int, user_id: int, giftee_id: int):
+class JoinStatus(StrEnum):
+    JOINED = "joined"
+    ALREADY_JOINED = "already_joined"
+    STARTED = "started"
+    NO_CAMPAIGN = "no_campaign"
+
+
+class LeaveStatus(StrEnum):
+    LEFT = "left"
+    ORGANIZER = "organizer"
+    STARTED = "started"
+    NOT_MEMBER = "not_member"
+
+
+class StartStatus(StrEnum):
+    READY = "ready"
+    NO_MEMBERS = "no_members"
+    TOO_FEW_MEMBERS = "too_few_members"
+    NOT_ORGANIZER = "not_organizer"
+    NOT_AWAITING = "not_awaiting"
+
+
+# the statements in capitals are also checked by benchmarks/query_plans.py
+JOIN_CAMPAIGN = """
+WITH campaign AS (
+    SELECT state FROM Campaigns WHERE guild_id = %(guild_id)s FOR SHARE
+), inserted AS (
+    INSERT INTO Memberships (user_id, guild_id)
+    SELECT %(user_id)s, %(guild_id)s FROM campaign WHERE state = 'awaiting'
+    ON CONFLICT DO NOTHING
+    RETURNING 1
+), notified AS (
+    SELECT pg_notify(%(channel)s::TEXT, %(payload)s::TEXT) FROM inserted WHERE %(channel)s::TEXT IS NOT NULL
+)
+SELECT
+    CASE
+        WHEN NOT EXISTS (SELECT 1 FROM campaign) THEN 'no_campaign'
+        WHEN (SELECT state FROM campaign) = 'started' THEN 'started'
+        WHEN EXISTS (SELECT 1 FROM inserted) THEN 'joined'
+        ELSE 'already_joined'
+    END,
+    (SELECT count(*) FROM notified);  -- a CTE without side effects only runs if it is read
+"""
+
+
+async def join_campaign(
+    cur: AsyncCursor, guild_id: int, user_id: int, notify: tuple[str, str] | None = None
+) -> JoinStatus:
+    """Check the campaign state and add the member in a single round trip.
+
+    Joins only share-lock the campaign row, so they run concurrently with each other and only wait
+    for (or hold back) a start of the campaign; duplicates are settled by the primary key. If the
+    member was added, the (channel, payload) notification `notify` is sent by the same statement.
+    """
     await cur.execute(
-        """INSERT INTO Giftees (user_id, guild_id) VALUES (%s, %s);""",
-        (giftee_id, guild_id),
+        JOIN_CAMPAIGN,
+        {"guild_id": guild_id, "user_id": user_id, "channel": notify and notify[0], "payload": notify and notify[1]},
+        prepare=PREPARE,
+        statement="join_campaign",
     )
+    return JoinStatus((await cur.fetchone())[0])
+
+
+LEAVE_CAMPAIGN = """
+WITH campaign AS (
+    SELECT state FROM Campaigns WHERE guild_id = %(guild_id)s FOR SHARE
+), membership AS (
+    SELECT is_organizer FROM Memberships WHERE user_id = %(user_id)s AND guild_id = %(guild_id)s
+), deleted AS (
+    DELETE FROM Memberships
+    WHERE user_id = %(user_id)s AND guild_id = %(guild_id)s AND NOT is_organizer
+      AND EXISTS (SELECT 1 FROM campaign WHERE state = 'awaiting')
+    RETURNING 1
+), notified AS (
+    SELECT pg_notify(%(channel)s::TEXT, %(payload)s::TEXT) FROM deleted WHERE %(channel)s::TEXT IS NOT NULL
+)
+SELECT
+    CASE
+        WHEN (SELECT is_organizer FROM membership) THEN 'organizer'
+        WHEN (SELECT state FROM campaign) = 'started' THEN 'started'
+        WHEN EXISTS (SELECT 1 FROM deleted) THEN 'left'
+        ELSE 'not_member'
+    END,
+    (SELECT count(*) FROM notified);  -- a CTE without side effects only runs if it is read
+"""
+
+
+async def leave_campaign(
+    cur: AsyncCursor, guild_id: int, user_id: int, notify: tuple[str, str] | None = None
+) -> LeaveStatus:
+    """Check the organizer flag and the campaign state and remove the member in a single round trip.
+
+    If the member was removed, the (channel, payload) notification `notify` is sent by the same statement.
+    """
     await cur.execute(
-        """UPDATE Memberships SET giftee = (select id from Giftees where user_id = %s) WHERE user_id = %s AND guild_id = %s;""",
-        (giftee_id, user_id, guild_id),
+        LEAVE_CAMPAIGN,
+        {"guild_id": guild_id, "user_id": user_id, "channel": notify and notify[0], "payload": notify and notify[1]},
+        prepare=PREPARE,
+        statement="leave_campaign",
     )
+    return LeaveStatus((await cur.fetchone())[0])
 
 
-# Monkey patch the advisory lock method into the async cursor
-psycopg.AsyncCursor.advisory_lock = lambda self, id: self.execute("SELECT pg_advisory_xact_lock(%s);", (id,))
+LOCK_CAMPAIGN = "SELECT 1 FROM Campaigns WHERE guild_id = %s FOR UPDATE;"
+
+
+CHECK_START = """
+WITH campaign AS (
+    SELECT state FROM Campaigns WHERE guild_id = %(guild_id)s
+), members AS (
+    SELECT user_id, is_organizer FROM Memberships WHERE guild_id = %(guild_id)s
+)
+SELECT
+    CASE
+        WHEN NOT EXISTS (SELECT 1 FROM members) THEN 'no_members'
+        WHEN (SELECT count(*) FROM members) < 3 THEN 'too_few_members'
+        WHEN NOT EXISTS (SELECT 1 FROM members WHERE user_id = %(user_id)s AND is_organizer) THEN 'not_organizer'
+        WHEN (SELECT state FROM campaign) <> 'awaiting' THEN 'not_awaiting'
+        ELSE 'ready'
+    END,
+    ARRAY(SELECT user_id FROM members),
+    ARRAY(SELECT ARRAY[giver_id, giftee_id] FROM Exclusions WHERE guild_id = %(guild_id)s),
+    ARRAY(
+        SELECT ARRAY[giver_id, giftee_id]
+        FROM PastAssignments
+        WHERE guild_id = %(guild_id)s
+          AND started_at = (SELECT max(started_at) FROM PastAssignments WHERE guild_id = %(guild_id)s)
+    );
+"""
+
+
+async def check_start(
+    cur: AsyncCursor, guild_id: int, user_id: int
+) -> tuple[StartStatus, list[int], list[tuple[int, int]], list[tuple[int, int]]]:
+    """Check whether `user_id` may start the campaign, in a single round trip.
+
+    Also returns everything needed to draw the assignments: the members, the organizer's exclusions
+    and the pairs drawn by the previous campaign of the guild. The campaign row stays locked until the
+    transaction ends, so nobody can join or leave while the assignments are drawn. The lock is taken by
+    a statement of its own, pipelined with the check: the check then sees every join committed while
+    waiting for it.
+    """
+    async with cur.connection.pipeline():
+        await cur.connection.cursor().execute(
+            LOCK_CAMPAIGN,
+            (guild_id,),
+            prepare=PREPARE,
+            statement="lock_campaign",
+        )
+        await cur.execute(
+            CHECK_START,
+            {"guild_id": guild_id, "user_id": user_id},
+            prepare=PREPARE,
+            statement="check_start",
+        )
+    status, members, exclusions, last_pairs = await cur.fetchone()
+    return StartStatus(status), members, [tuple(pair) for pair in exclusions], [tuple(pair) for pair in last_pairs]
+
+
+async def start_campaign(cur: AsyncCursor, guild_id: int, assignments: list[tuple[int, int]]):
+    """Mark the campaign as started and persist all its (giver, giftee) pairs in a single statement.
+
+    The pairs are also remembered in PastAssignments, so next year's campaign can avoid repeats.
+    """
+    givers, giftees = zip(*assignments)
+    await cur.execute(
+        """
+        WITH pairs AS (
+            SELECT * FROM unnest(%(givers)s::BIGINT[], %(giftees)s::BIGINT[]) AS p(giver_id, giftee_id)
+        ), started AS (
+            UPDATE Campaigns SET state = 'started' WHERE guild_id = %(guild_id)s
+        ), history AS (
+            INSERT INTO PastAssignments (guild_id, started_at, giver_id, giftee_id)
+            SELECT %(guild_id)s, CURRENT_TIMESTAMP, giver_id, giftee_id FROM pairs
+        ), inserted AS (
+            INSERT INTO Giftees (user_id, guild_id)
+            SELECT giftee_id, %(guild_id)s FROM pairs
+            RETURNING id, user_id
+        )
+        UPDATE Memberships m
+        SET giftee = inserted.id
+        FROM pairs
+        INNER JOIN inserted ON inserted.user_id = pairs.giftee_id
+        WHERE m.user_id = pairs.giver_id AND m.guild_id = %(guild_id)s;
+        """,
+        {"guild_id": guild_id, "givers": list(givers), "giftees": list(giftees)},
+        statement="start_campaign",
+    )
+
 
 # Connection string constructor for the database
 conninfo = psycopg.conninfo.make_conninfo(
@@ -29,8 +212,156 @@ conninfo = psycopg.conninfo.make_conninfo(
     dbname=config.get("Postgres", "database"),
 )
 
+# Optional read replica, any option left out is the same as for the primary
+replica_conninfo = (
+    psycopg.conninfo.make_conninfo(
+        conninfo="",
+        host=config.get("Replica", "host"),
+        port=config.get("Replica", "port", fallback=config.get("Postgres", "port")),
+        user=config.get("Replica", "user", fallback=config.get("Postgres", "user")),
+        password=config.get("Replica", "password", fallback=config.get("Postgres", "password")),
+        dbname=config.get("Replica", "database", fallback=config.get("Postgres", "database")),
+    )
+    if config.get("Replica", "host", fallback="")
+    else None
+)
+# seconds reads stick to the primary after a write, longer than the replica usually lags behind
+READ_YOUR_WRITES_WINDOW = config.getfloat("Replica", "read_your_writes_window", fallback=5)
+
+POOL_MIN_SIZE = config.getint("Pool", "min_size", fallback=4)
+POOL_MAX_SIZE = config.getint("Pool", "max_size", fallback=POOL_MIN_SIZE)
+POOL_TIMEOUT = config.getfloat("Pool", "timeout", fallback=30)  # seconds to wait for a free connection
+POOL_MAX_WAITING = config.getint("Pool", "max_waiting", fallback=0)  # requests queued at most, 0 for no limit
+POOL_MAX_IDLE = config.getfloat("Pool", "max_idle", fallback=10 * 60)
+POOL_MAX_LIFETIME = config.getfloat("Pool", "max_lifetime", fallback=60 * 60)
+# executions after which psycopg prepares a query on its own, empty to never prepare anything
+# (e.g. behind PgBouncer in transaction mode)
+_prepare_threshold = config.get("Pool", "prepare_threshold", fallback="5")
+PREPARE_THRESHOLD = int(_prepare_threshold) if _prepare_threshold else None
+# hot queries are prepared on their first execution, unless preparing is disabled
+PREPARE = True if PREPARE_THRESHOLD is not None else None
+
+
+@dataclass
+class PoolStats:
+    acquired: int = 0
+    acquire_seconds: float = 0.0
+    max_acquire_seconds: float = 0.0
+
+    @property
+    def mean_acquire_seconds(self) -> float:
+        return self.acquire_seconds / self.acquired if self.acquired else 0.0
+
+
+stats = PoolStats()
+
+
+class TimedCursor(psycopg.AsyncCursor):
+    """Cursor recording the duration of every statement it executes, labelled with `statement` if given."""
+
+    async def execute(self, query, params=None, *, statement: str | None = None, **kwargs):
+        with metrics.db_query_seconds.time(statement=statement or metrics.statement_label(query)):
+            return await super().execute(query, params, **kwargs)
+
+    async def executemany(self, query, params_seq, *, statement: str | None = None, **kwargs):
+        with metrics.db_query_seconds.time(statement=statement or metrics.statement_label(query)):
+            return await super().executemany(query, params_seq, **kwargs)
+
+
+def _create_pool(conninfo: str) -> psycopg_pool.AsyncConnectionPool:
+    return psycopg_pool.AsyncConnectionPool(
+        conninfo,
+        open=False,
+        min_size=POOL_MIN_SIZE,
+        max_size=POOL_MAX_SIZE,
+        timeout=POOL_TIMEOUT,
+        max_waiting=POOL_MAX_WAITING,
+        max_idle=POOL_MAX_IDLE,
+        max_lifetime=POOL_MAX_LIFETIME,
+        kwargs={"prepare_threshold": PREPARE_THRESHOLD, "cursor_factory": TimedCursor},
+    )
+
+
 # Must be created inside main event loop
-connection_pool = psycopg_pool.AsyncConnectionPool(conninfo, open=False)
+connection_pool = _create_pool(conninfo)
+replica_pool = _create_pool(replica_conninfo) if replica_conninfo else None
+
+# when the reads about a guild or user (snowflakes never collide) must go to the primary until
+_written: dict[object, float] = {}
+
+
+async def open_pools():
+    """Open the pools, waiting for their `min_size` connections, and check that every database answers.
+
+    Raises `psycopg_pool.PoolTimeout` or `psycopg.Error` if one cannot be reached.
+    """
+    for pool in (connection_pool, replica_pool):
+        if pool is None:
+            continue
+        await pool.open(wait=True, timeout=POOL_TIMEOUT)
+        async with pool.connection() as conn:
+            await conn.execute("SELECT 1;")
 
-# Shorthand for getting a connection from our connection pool
-get_connection = connection_pool.connection
+
+@asynccontextmanager
+async def _borrow(pool: psycopg_pool.AsyncConnectionPool) -> AsyncIterator[psycopg.AsyncConnection]:
+    start = monotonic()
+    async with pool.connection() as conn:
+        elapsed = monotonic() - start
+        stats.acquired += 1
+        stats.acquire_seconds += elapsed
+        stats.max_acquire_seconds = max(stats.max_acquire_seconds, elapsed)
+        metrics.db_acquire_seconds.observe(elapsed)
+        yield conn
+
+
+def get_connection() -> AbstractAsyncContextManager[psycopg.AsyncConnection]:
+    """Borrow a connection to the primary from our connection pool, committing on exit."""
+    return _borrow(connection_pool)
+
+
+def mark_written(*keys):
+    """Send the reads about these guilds or users to the primary for a while, so they see what was just written."""
+    now = monotonic()
+    if len(_written) > constants.WRITTEN_KEYS_LIMIT:
+        for key in [key for key, until in _written.items() if until < now]:
+            del _written[key]
+    for key in keys:
+        _written[key] = now + READ_YOUR_WRITES_WINDOW
+
+
+def get_read_connection(*keys) -> AbstractAsyncContextManager[psycopg.AsyncConnection]:
+    """Borrow a connection for reads that may lag a little behind, from the replica if there is one.
+
+    Falls back to the primary while any of `keys` (guild or user IDs) was written recently.
+    """
+    now = monotonic()
+    if replica_pool is None or any(_written.get(key, 0) > now for key in keys):
+        metrics.db_reads.inc(target="primary")
+        return _borrow(connection_pool)
+    metrics.db_reads.inc(target="replica")
+    return _borrow(replica_pool)
+
+
+def pool_stats() -> dict[str, int]:
+    """psycopg_pool's own counters: `pool_size`, `pool_available`, `requests_waiting`, `requests_errors`..."""
+    return connection_pool.get_stats()
+
+
+def replica_pool_stats() -> dict[str, int] | None:
+    return replica_pool.get_stats() if replica_pool is not None else None
+
+
+metrics.Gauge("santa_db_pool_size", "Open pool connections.", lambda: pool_stats()["pool_size"])
+metrics.Gauge(
+    "santa_db_pool_in_use",
+    "Pool connections lent out.",
+    lambda: (pool := pool_stats())["pool_size"] - pool["pool_available"],
+)
+metrics.Gauge("santa_db_pool_requests_waiting", "Requests waiting for a pool connection.", lambda: pool_stats()["requests_waiting"])
+if replica_pool is not None:
+    metrics.Gauge(
+        "santa_db_replica_pool_in_use",
+        "Replica pool connections lent out.",
+        lambda: (pool := replica_pool_stats())["pool_size"] - pool["pool_available"],
+    )
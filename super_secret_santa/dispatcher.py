@@ -0,0 +1,145 @@
+import asyncio
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass, field
+from time import monotonic
+
+import discord
+from loguru import logger
+
+from . import constants, metrics, resolver
+
+
+# replaced in a message's content by its giftee's mention and name, resolved when it is sent
+GIFTEE = "{giftee}"
+
+
+@dataclass
+class DirectMessage:
+    recipient_id: int
+    content: str
+    giftee_id: int | None = None
+    outbox_id: int | None = None
+    error: str | None = None
+
+
+def describe(user_id: int, user: discord.User | None) -> str:
+    return f"<@{user_id}> ({user.display_name})" if user else f"<@{user_id}>"
+
+
+@dataclass
+class DispatchReport:
+    total: int
+    sent: list[DirectMessage] = field(default_factory=list)
+    failed: list[DirectMessage] = field(default_factory=list)
+
+    @property
+    def done(self) -> int:
+        return len(self.sent) + len(self.failed)
+
+
+class RateLimiter:
+    """Token bucket shared by every dispatch, so concurrent campaigns split the send budget."""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+rate_limiter = RateLimiter(constants.DM_SEND_RATE)
+
+
+async def dispatch(
+    messages: list[DirectMessage],
+    on_progress: Callable[[DispatchReport], Awaitable[None]] | None = None,
+    on_outcome: Callable[[DirectMessage], Awaitable[None]] | None = None,
+) -> DispatchReport:
+    """Send direct messages from a bounded pool of workers without blocking the event loop.
+
+    `on_outcome` is called with every message as soon as it was sent or failed (see `DirectMessage.error`).
+    """
+    report = DispatchReport(total=len(messages))
+    if not messages:
+        return report
+
+    users = await resolver.get_users(
+        user_id for message in messages for user_id in (message.recipient_id, message.giftee_id) if user_id is not None
+    )
+    queue: asyncio.Queue[DirectMessage] = asyncio.Queue()
+    for message in messages:
+        queue.put_nowait(message)
+
+    async def worker():
+        while not queue.empty():
+            message = queue.get_nowait()
+            user = users.get(message.recipient_id)
+            if user is None:
+                message.error = "Unknown user"
+                report.failed.append(message)
+                metrics.dm_outcomes.inc(outcome="unknown_user")
+                await record(message)
+                continue
+
+            await rate_limiter.acquire()
+            try:
+                content = message.content
+                if message.giftee_id is not None:
+                    content = content.replace(GIFTEE, describe(message.giftee_id, users.get(message.giftee_id)))
+                await user.send(content)
+                report.sent.append(message)
+                metrics.dm_outcomes.inc(outcome="sent")
+                logger.debug(f"Sent message to {user.id} ({user.global_name})")
+            except discord.HTTPException as e:
+                message.error = str(e)
+                report.failed.append(message)
+                metrics.dm_outcomes.inc(outcome="forbidden" if isinstance(e, discord.Forbidden) else "failed")
+                logger.error(f"Could not send message to user {user.id}:\n{e}")
+            except Exception as e:  # e.g. a dropped connection: the other messages are still sent
+                message.error = str(e) or type(e).__name__
+                report.failed.append(message)
+                metrics.dm_outcomes.inc(outcome="failed")
+                logger.error(f"Could not send message to user {user.id}:\n{e!r}")
+            await record(message)
+
+    async def record(message: DirectMessage):
+        if on_outcome is None:
+            return
+        try:
+            await on_outcome(message)
+        except Exception as e:
+            logger.error(f"Could not record the outcome of the message to user {message.recipient_id}:\n{e}")
+
+    async def notify_progress():
+        try:
+            await on_progress(report)
+        except discord.HTTPException as e:
+            logger.warning(f"Could not report dispatch progress: {e}")
+
+    async def report_progress():
+        while True:
+            await asyncio.sleep(constants.DM_PROGRESS_INTERVAL)
+            await notify_progress()
+
+    progress_task = asyncio.create_task(report_progress()) if on_progress else None
+    try:
+        await asyncio.gather(*(worker() for _ in range(min(constants.DM_WORKER_COUNT, len(messages)))))
+    finally:
+        if progress_task:
+            progress_task.cancel()
+
+    if on_progress:
+        await notify_progress()
+    return report
@@ -1,16 +1,19 @@
 from loguru import logger
 
-from .database import connection_pool
 from .bot import bot
-from .views import CampaignView
-from . import constants
+from . import cluster, constants, events, metrics, outbox, startup
 
 
 def setup():
     @bot.event
     async def on_ready():
-        await connection_pool.open()
-        bot.add_view(CampaignView())
+        if not startup.ready():
+            logger.info(f"Reconnected as {bot.user}")
+            return
+        outbox.start()
+        cluster.start()
+        events.start()
+        await metrics.start()
         logger.info(
             f"We have logged in as {bot.user}. "
             "Add to your server: "
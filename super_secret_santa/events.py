@@ -0,0 +1,121 @@
+import asyncio
+from collections import defaultdict
+from collections.abc import Callable
+from enum import StrEnum
+from uuid import uuid4
+
+from loguru import logger
+import psycopg
+from psycopg import AsyncCursor
+
+from . import constants
+from .database import connection_pool, mark_written
+
+CHANNEL = "santa_invalidate"
+# tells our own notifications apart: writers update their local caches themselves, after committing
+ORIGIN = uuid4().hex[:12]
+
+
+class Event(StrEnum):
+    CAMPAIGN = "campaign"  # created, started or deleted
+    MEMBERS = "members"  # someone joined or left
+    EXCLUSIONS = "exclusions"
+
+
+# a handler is called with the guild ID, or None when everything must be forgotten (events were missed)
+Handler = Callable[[int | None], None]
+
+_handlers: dict[Event, list[Handler]] = defaultdict(list)
+_pending: set[tuple[Event, int]] = set()
+_flush: asyncio.TimerHandle | None = None
+_worker: asyncio.Task | None = None
+
+
+def subscribe(event: Event, handler: Handler):
+    _handlers[event].append(handler)
+
+
+def notification(guild_id: int, event: Event) -> tuple[str, str]:
+    """Channel and payload of an event, for the statements that send it themselves with pg_notify."""
+    mark_written(guild_id)
+    return CHANNEL, f"{event}:{guild_id}:{ORIGIN}"
+
+
+async def publish(cur: AsyncCursor, guild_id: int, event: Event):
+    """Tell every other process about a write, when the caller's transaction commits.
+
+    Postgres drops duplicate notifications within a transaction, the receivers coalesce the rest.
+    """
+    await cur.execute("SELECT pg_notify(%s, %s);", notification(guild_id, event))
+
+
+def _dispatch(event: Event, guild_id: int | None):
+    for handler in _handlers[event]:
+        try:
+            handler(guild_id)
+        except Exception as e:
+            logger.error(f"Could not handle {event} event of guild {guild_id}:\n{e}")
+
+
+def _flush_pending():
+    global _flush
+    _flush = None
+    batch = list(_pending)
+    _pending.clear()
+    for event, guild_id in batch:
+        _dispatch(event, guild_id)
+
+
+def _received(payload: str):
+    global _flush
+    try:
+        event, guild_id, origin = payload.split(":")
+        event, guild_id = Event(event), int(guild_id)
+    except ValueError:
+        logger.warning(f"Ignoring malformed event {payload!r}")
+        return
+    if origin == ORIGIN:
+        return
+    # the replica may not have it yet
+    mark_written(guild_id)
+    # a burst of joins makes one invalidation per guild, not one per click
+    _pending.add((event, guild_id))
+    if _flush is None:
+        _flush = asyncio.get_running_loop().call_later(constants.EVENT_COALESCE_DELAY, _flush_pending)
+
+
+async def _listen():
+    conn = await connection_pool.getconn()
+    try:
+        await conn.set_autocommit(True)
+        await conn.execute(f"LISTEN {CHANNEL};")
+        # whatever was published while we were not listening is lost
+        for event in Event:
+            _dispatch(event, None)
+        async for notify in conn.notifies():
+            _received(notify.payload)
+    finally:
+        # hand it back as we got it, or broken so that the pool replaces it
+        try:
+            if not conn.closed:
+                await conn.execute(f"UNLISTEN {CHANNEL};")
+                await conn.set_autocommit(False)
+        except psycopg.Error:
+            await conn.close()
+        await connection_pool.putconn(conn)
+
+
+async def _run():
+    while True:
+        try:
+            await _listen()
+        except Exception as e:
+            logger.error(f"Lost the event listener connection, reconnecting:\n{e}")
+        await asyncio.sleep(constants.EVENT_RECONNECT_DELAY)
+
+
+def start():
+    """Start listening to the other processes' events on a connection of our own from the pool."""
+    global _worker
+    if _worker is None or _worker.done():
+        _worker = asyncio.create_task(_run())
@@ -0,0 +1,256 @@
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from collections.abc import Callable
+from contextlib import contextmanager
+from functools import wraps
+from hashlib import sha1
+from time import monotonic
+
+import discord
+from loguru import logger
+
+from .bot import CLUSTER_ID, bot
+from .config import config
+
+ENABLED = config.getboolean("Metrics", "enabled", fallback=False)
+HOST = config.get("Metrics", "host", fallback="127.0.0.1")
+# every cluster of shards serves its own metrics, on the next port
+PORT = config.getint("Metrics", "port", fallback=9464) + CLUSTER_ID
+
+# seconds, from a cached lookup to a large campaign being started
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_registry: list["Metric"] = []
+_server: asyncio.Server | None = None
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric(ABC):
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = labels
+        _registry.append(self)
+
+    def _key(self, labels: dict[str, str]) -> tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    @abstractmethod
+    def samples(self) -> list[str]: ...
+
+    def render(self) -> str:
+        return "\n".join(
+            [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}", *self.samples()]
+        )
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> list[str]:
+        return [f"{self.name}{_labels(self.label_names, key)} {value}" for key, value in self._values.items()]
+
+
+class Gauge(Metric):
+    """Value read when scraped, e.g. from one of the existing stats objects."""
+
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, read: Callable[[], float]):
+        super().__init__(name, documentation)
+        self.read = read
+
+    def samples(self) -> list[str]:
+        return [f"{self.name} {self.read()}"]
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self, name: str, documentation: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labels)
+        self.buckets = buckets
+        # per label values: count per bucket (the last one is +Inf), sum
+        self._values: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = self._key(labels)
+        if (entry := self._values.get(key)) is None:
+            entry = self._values[key] = ([0] * (len(self.buckets) + 1), [0.0])
+        counts, total = entry
+        counts[bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    @contextmanager
+    def time(self, **labels: str):
+        start = monotonic()
+        try:
+            yield
+        finally:
+            self.observe(monotonic() - start, **labels)
+
+    def samples(self) -> list[str]:
+        lines = []
+        for key, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip([*self.buckets, "+Inf"], counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, key, f'le="{bound}"')} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {total[0]}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, key)} {cumulative}")
+        return lines
+
+
+interaction_seconds = Histogram(
+    "santa_interaction_duration_seconds", "Time spent handling a slash command or button press.", ("interaction",)
+)
+interaction_errors = Counter(
+    "santa_interaction_errors_total", "Slash commands and button presses that raised.", ("interaction",)
+)
+db_query_seconds = Histogram("santa_db_query_duration_seconds", "Time spent executing a SQL statement.", ("statement",))
+db_acquire_seconds = Histogram("santa_db_pool_acquire_seconds", "Time spent waiting for a pool connection.")
+db_reads = Counter("santa_db_reads_total", "Connections borrowed for reads, by database.", ("target",))
+discord_requests = Counter(
+    "santa_discord_requests_total", "Discord REST API calls by route and status.", ("method", "route", "status")
+)
+discord_rate_limits = Counter(
+    "santa_discord_rate_limited_total", "429 responses from Discord, retried by py-cord.", ("scope",)
+)
+dm_outcomes = Counter("santa_dm_total", "Direct messages by outcome.", ("outcome",))
+pdf_render_seconds = Histogram("santa_pdf_render_duration_seconds", "Time spent rendering a PDF part.")
+
+
+def timed(name: str | None = None):
+    """Record the duration and failures of a command or button callback, labelled with `name` or its own name."""
+
+    def decorator(func):
+        label = name or func.__name__
+
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = monotonic()
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                interaction_errors.inc(interaction=label)
+                raise
+            finally:
+                interaction_seconds.observe(monotonic() - start, interaction=label)
+
+        return wrapper
+
+    return decorator
+
+
+def statement_label(query) -> str:
+    """Label of a statement run without a name: its first words and a hash of all of it, so statements starting
+    alike are told apart. Queries are static with separate parameters, so the labels stay bounded."""
+    text = " ".join(str(query).split())
+    return f"{text[:60]} #{sha1(text.encode()).hexdigest()[:8]}"
+
+
+class _RateLimitHandler(logging.Handler):
+    # py-cord retries 429s on its own and only tells through these warnings: one for every 429, then right
+    # away (in the same step of the same task) a second one if it was global. Every 429 is counted once, as
+    # global if the second warning came before the end of that step, as a bucket one otherwise.
+    def __init__(self, level: int):
+        super().__init__(level)
+        self._undecided = 0
+
+    def _count_bucket(self):
+        if self._undecided:
+            self._undecided -= 1
+            discord_rate_limits.inc(scope="bucket")
+
+    def emit(self, record: logging.LogRecord):
+        if not isinstance(record.msg, str):
+            return
+        if record.msg.startswith("We are being rate limited"):
+            self._undecided += 1
+            try:
+                asyncio.get_running_loop().call_soon(self._count_bucket)
+            except RuntimeError:
+                self._count_bucket()
+        elif record.msg.startswith("Global rate limit") and self._undecided:
+            self._undecided -= 1
+            discord_rate_limits.inc(scope="global")
+
+
+def _instrument_http():
+    request = bot.http.request
+
+    @wraps(request)
+    async def timed_request(route, **kwargs):
+        status = "error"
+        try:
+            response = await request(route, **kwargs)
+            status = "ok"
+            return response
+        except discord.HTTPException as e:
+            status = str(e.status)
+            raise
+        finally:
+            discord_requests.inc(method=route.method, route=route.path, status=status)
+
+    bot.http.request = timed_request
+    logging.getLogger("discord.http").addHandler(_RateLimitHandler(logging.WARNING))
+
+
+def render() -> str:
+    return "\n".join(metric.render() for metric in _registry) + "\n"
+
+
+async def _serve(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request_line = await reader.readline()
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass  # headers are not needed
+        method, path, *_ = request_line.decode("latin-1").split() or ("", "")
+        if method == "GET" and path.split("?")[0] == "/metrics":
+            status, body = "200 OK", render().encode()
+        else:
+            status, body = "404 Not Found", b"Not found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode()
+            + body
+        )
+        await writer.drain()
+    except (ConnectionError, ValueError) as e:
+        logger.debug(f"Metrics request failed: {e}")
+    finally:
+        writer.close()
+
+
+async def start():
+    """Instrument the Discord HTTP client and serve /metrics on the running loop, once, if enabled."""
+    global _server
+    if not ENABLED or _server is not None:
+        return
+    _instrument_http()
+    _server = await asyncio.start_server(_serve, HOST, PORT)
+    logger.info(f"Serving metrics on http://{HOST}:{PORT}/metrics")
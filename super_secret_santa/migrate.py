@@ -0,0 +1,84 @@
+import asyncio
+from dataclasses import dataclass
+from pathlib import Path
+
+from loguru import logger
+from psycopg import AsyncConnection
+
+from . import constants
+from .database import conninfo
+
+MIGRATIONS_DIR = Path(__file__).parent / "migrations"
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    name: str
+    path: Path
+
+
+def migrations() -> list[Migration]:
+    """Every migration shipped with the bot, in order. Files are named `<version>_<name>.sql`."""
+    found = []
+    for path in MIGRATIONS_DIR.glob("*.sql"):
+        version, _, name = path.stem.partition("_")
+        found.append(Migration(int(version), name, path))
+    found.sort(key=lambda migration: migration.version)
+    if len({migration.version for migration in found}) != len(found):
+        raise RuntimeError(f"Duplicate migration versions in {MIGRATIONS_DIR}")
+    return found
+
+
+async def applied_versions(conn: AsyncConnection) -> set[int]:
+    await conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS SchemaMigrations (
+            version    INTEGER PRIMARY KEY,
+            name       TEXT NOT NULL,
+            applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+        """
+    )
+    cur = await conn.execute("SELECT version FROM SchemaMigrations;")
+    return {row[0] for row in await cur.fetchall()}
+
+
+async def pending(conn: AsyncConnection) -> list[Migration]:
+    applied = await applied_versions(conn)
+    return [migration for migration in migrations() if migration.version not in applied]
+
+
+async def migrate(conn: AsyncConnection, apply: bool = True) -> list[Migration]:
+    """Apply the pending migrations in a single transaction and return them.
+
+    Concurrent bot instances wait for each other on an advisory lock. With `apply=False`, only
+    check: raise a `RuntimeError` listing the pending migrations, if any.
+    """
+    async with conn.transaction():
+        await conn.execute(
+            "SELECT pg_advisory_xact_lock(%s, %s);", (constants.ADVISORY_LOCK_NAMESPACE, constants.MIGRATIONS_LOCK)
+        )
+        todo = await pending(conn)
+        if todo and not apply:
+            raise RuntimeError(
+                "The database schema is out of date, pending migrations: "
+                + ", ".join(migration.path.name for migration in todo)
+            )
+        for migration in todo:
+            logger.info(f"Applying migration {migration.path.name}")
+            await conn.execute(migration.path.read_text())
+            await conn.execute(
+                "INSERT INTO SchemaMigrations (version, name) VALUES (%s, %s);", (migration.version, migration.name)
+            )
+    return todo
+
+
+async def main():
+    async with await AsyncConnection.connect(conninfo) as conn:
+        applied = await migrate(conn)
+    logger.info(f"Applied {len(applied)} migrations, the database is up to date")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,65 @@
+-- idempotent, so databases created from the former schema.sql can be migrated as they are
+DO $$ BEGIN
+    CREATE TYPE CampaignState AS ENUM ('awaiting', 'started');
+EXCEPTION
+    WHEN duplicate_object THEN NULL;
+END $$;
+
+CREATE TABLE IF NOT EXISTS Campaigns (
+    guild_id   BIGINT PRIMARY KEY,
+    name       TEXT NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    state      CampaignState NOT NULL DEFAULT 'awaiting'
+);
+
+CREATE TABLE IF NOT EXISTS Giftees (
+    id          SERIAL PRIMARY KEY,
+    user_id     BIGINT NOT NULL,
+    guild_id    BIGINT NOT NULL REFERENCES Campaigns(guild_id) ON DELETE CASCADE,
+    UNIQUE      (user_id, guild_id)
+);
+
+CREATE TABLE IF NOT EXISTS Memberships (
+    user_id      BIGINT NOT NULL,
+    guild_id     BIGINT NOT NULL REFERENCES Campaigns(guild_id) ON DELETE CASCADE,
+    is_organizer BOOLEAN NOT NULL DEFAULT FALSE,
+    giftee       INTEGER REFERENCES Giftees(id) DEFAULT NULL,
+    PRIMARY KEY  (user_id, guild_id)
+);
+
+CREATE TABLE IF NOT EXISTS Outbox (
+    id           SERIAL PRIMARY KEY,
+    user_id      BIGINT NOT NULL,
+    guild_id     BIGINT NOT NULL REFERENCES Campaigns(guild_id) ON DELETE CASCADE,
+    content      TEXT NOT NULL,
+    attempts     INTEGER NOT NULL DEFAULT 0,
+    next_attempt TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    sent_at      TIMESTAMP DEFAULT NULL,
+    last_error   TEXT DEFAULT NULL
+);
+
+CREATE TABLE IF NOT EXISTS Exclusions (
+    guild_id    BIGINT NOT NULL REFERENCES Campaigns(guild_id) ON DELETE CASCADE,
+    giver_id    BIGINT NOT NULL,
+    giftee_id   BIGINT NOT NULL,
+    PRIMARY KEY (guild_id, giver_id, giftee_id)
+);
+
+-- not tied to a campaign: it outlives /santa delete so next year's campaign can avoid repeats
+CREATE TABLE IF NOT EXISTS PastAssignments (
+    guild_id    BIGINT NOT NULL,
+    started_at  TIMESTAMP NOT NULL,
+    giver_id    BIGINT NOT NULL,
+    giftee_id   BIGINT NOT NULL,
+    PRIMARY KEY (guild_id, started_at, giver_id)
+);
+
+-- rendered /santa pdf parts, keyed by a hash of everything that ends up in them
+CREATE TABLE IF NOT EXISTS PdfCache (
+    guild_id    BIGINT NOT NULL REFERENCES Campaigns(guild_id) ON DELETE CASCADE,
+    digest      TEXT NOT NULL,
+    part        INTEGER NOT NULL,
+    data        BYTEA NOT NULL,
+    complete    BOOLEAN NOT NULL DEFAULT FALSE,
+    PRIMARY KEY (guild_id, digest, part)
+);
@@ -0,0 +1,10 @@
+-- campaign-wide reads: /santa list, /santa pdf, starting a campaign; also used by the cascades
+-- run when a campaign is deleted
+CREATE INDEX IF NOT EXISTS memberships_guild_id ON Memberships (guild_id);
+CREATE INDEX IF NOT EXISTS giftees_guild_id ON Giftees (guild_id);
+CREATE INDEX IF NOT EXISTS outbox_guild_id ON Outbox (guild_id);
+-- deleting giftees must find the memberships pointing at them
+CREATE INDEX IF NOT EXISTS memberships_giftee ON Memberships (giftee);
+
+-- the retry poller only ever scans pending messages, sent ones just pile up
+CREATE INDEX IF NOT EXISTS outbox_pending ON Outbox (next_attempt) WHERE sent_at IS NULL;
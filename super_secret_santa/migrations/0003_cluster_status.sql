@@ -0,0 +1,7 @@
+-- one row per cluster of shards, refreshed periodically so /santa status can sum them up
+CREATE TABLE IF NOT EXISTS ClusterStatus (
+    cluster_id  INTEGER PRIMARY KEY,
+    shard_ids   INTEGER[] NOT NULL,
+    guild_count INTEGER NOT NULL,
+    updated_at  TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
@@ -0,0 +1,2 @@
+-- the giftee an assignment DM is about, described when the DM is sent rather than when it is queued
+ALTER TABLE Outbox ADD COLUMN IF NOT EXISTS giftee_id BIGINT DEFAULT NULL;
@@ -0,0 +1,2 @@
+-- how many parts a complete cached PDF has, so an entry missing some of them is never served
+ALTER TABLE PdfCache ADD COLUMN IF NOT EXISTS parts INTEGER DEFAULT NULL;
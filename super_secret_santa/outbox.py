@@ -0,0 +1,146 @@
+import asyncio
+from collections.abc import Awaitable, Callable
+
+from loguru import logger
+from psycopg import AsyncCursor
+
+from . import constants
+from .database import get_connection
+from .dispatcher import DirectMessage, DispatchReport, dispatch
+
+_worker: asyncio.Task | None = None
+
+
+async def enqueue(cur: AsyncCursor, guild_id: int, messages: list[DirectMessage]):
+    """Persist direct messages in the outbox, as part of the caller's transaction.
+
+    They start out leased to the caller, which is expected to deliver them with `deliver_pending(guild_id)`:
+    the background worker only picks them up if that lease runs out.
+    """
+    await cur.executemany(
+        """
+        INSERT INTO Outbox (user_id, guild_id, content, giftee_id, next_attempt)
+        VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP + make_interval(secs => %s));
+        """,
+        [
+            (message.recipient_id, guild_id, message.content, message.giftee_id, constants.OUTBOX_LEASE)
+            for message in messages
+        ],
+    )
+
+
+# also checked by benchmarks/query_plans.py
+CLAIM = """
+SELECT id, user_id, content, giftee_id
+FROM Outbox
+WHERE sent_at IS NULL
+  AND attempts < %s
+  AND (
+      (%s::BIGINT IS NULL AND next_attempt <= CURRENT_TIMESTAMP)
+      OR (guild_id = %s AND (next_attempt <= CURRENT_TIMESTAMP OR attempts = 0))
+  )
+ORDER BY id
+LIMIT %s
+FOR UPDATE SKIP LOCKED;
+"""
+
+
+async def _claim(guild_id: int | None, limit: int | None) -> list[DirectMessage]:
+    # Claimed rows are leased until their next attempt, so nobody else picks them up meanwhile. The
+    # lease is renewed while they wait for the rate limiter, which every guild shares, and runs out
+    # if we crash: the messages not recorded as sent by then are retried. A guild's own delivery also
+    # takes its messages never attempted yet, which `enqueue` leased to it.
+    async with get_connection() as conn:
+        cur = conn.cursor()
+        await cur.execute(
+            CLAIM,
+            (constants.OUTBOX_MAX_ATTEMPTS, guild_id, guild_id, limit),
+        )
+        rows = await cur.fetchall()
+        if not rows:
+            return []
+
+        await cur.execute(
+            """
+            UPDATE Outbox
+            SET attempts = attempts + 1, next_attempt = CURRENT_TIMESTAMP + make_interval(secs => %s)
+            WHERE id = ANY(%s);
+            """,
+            (constants.OUTBOX_LEASE, [row[0] for row in rows]),
+        )
+
+    return [
+        DirectMessage(user_id, content, giftee_id, outbox_id=id) for id, user_id, content, giftee_id in rows
+    ]
+
+
+async def deliver_pending(
+    guild_id: int | None = None,
+    on_progress: Callable[[DispatchReport], Awaitable[None]] | None = None,
+) -> DispatchReport:
+    """Send due outbox messages (optionally only those of one guild), recording each outcome as it comes."""
+    limit = None if guild_id is not None else constants.OUTBOX_BATCH_SIZE
+    messages = await _claim(guild_id, limit)
+    pending = {message.outbox_id for message in messages}
+
+    async def record(message: DirectMessage):
+        pending.discard(message.outbox_id)
+        async with get_connection() as conn:
+            if message.error is None:
+                await conn.execute(
+                    "UPDATE Outbox SET sent_at = CURRENT_TIMESTAMP, last_error = NULL WHERE id = %s;",
+                    (message.outbox_id,),
+                )
+            else:
+                # retried later, backing off from the attempt counted when it was claimed
+                await conn.execute(
+                    """
+                    UPDATE Outbox
+                    SET last_error = %s,
+                        next_attempt = CURRENT_TIMESTAMP + make_interval(secs => %s * power(2, attempts - 1))
+                    WHERE id = %s;
+                    """,
+                    (message.error, constants.OUTBOX_RETRY_DELAY, message.outbox_id),
+                )
+
+    async def renew_lease():
+        while True:
+            await asyncio.sleep(constants.OUTBOX_LEASE / 2)
+            try:
+                async with get_connection() as conn:
+                    await conn.execute(
+                        """
+                        UPDATE Outbox SET next_attempt = CURRENT_TIMESTAMP + make_interval(secs => %s)
+                        WHERE id = ANY(%s) AND sent_at IS NULL;
+                        """,
+                        (constants.OUTBOX_LEASE, list(pending)),
+                    )
+            except Exception as e:
+                logger.error(f"Could not renew the lease of {len(pending)} outbox messages:\n{e}")
+
+    renewal = asyncio.create_task(renew_lease()) if messages else None
+    try:
+        return await dispatch(messages, on_progress=on_progress, on_outcome=record)
+    finally:
+        if renewal is not None:
+            renewal.cancel()
+
+
+async def _run():
+    while True:
+        try:
+            report = await deliver_pending()
+            if report.total:
+                logger.info(f"Outbox: delivered {len(report.sent)}/{report.total} pending messages")
+                continue  # there may be more due rows right away
+        except Exception as e:
+            logger.error(f"Outbox delivery failed:\n{e}")
+
+        await asyncio.sleep(constants.OUTBOX_POLL_INTERVAL)
+
+
+def start():
+    """Start the background delivery worker, resuming whatever was left undelivered."""
+    global _worker
+    if _worker is None or _worker.done():
+        _worker = asyncio.create_task(_run())
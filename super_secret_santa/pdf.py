@@ -1,93 +1,193 @@
+from dataclasses import dataclass
 from datetime import datetime
-from tempfile import NamedTemporaryFile
-from contextlib import contextmanager
+from functools import cached_property, lru_cache
+from io import BytesIO
 from textwrap import wrap
 
-from reportlab.lib.pagesizes import A4
+from reportlab.lib import pagesizes
 from reportlab.lib.units import cm
+from reportlab.pdfbase.pdfmetrics import stringWidth
 from reportlab.pdfgen import canvas
 from segno import make_qr
 
-CELL_X_COUNT = 2
-CELL_Y_COUNT = 7
-
-# PDF page geometry
-PAGE_WIDTH, PAGE_HEIGHT = A4
 MARGIN = 0.5 * cm
-CELL_WIDTH = (PAGE_WIDTH - 2 * MARGIN) / CELL_X_COUNT
 HEADER_HEIGHT = 1 * cm
-CELL_HEIGHT = (PAGE_HEIGHT - 2 * MARGIN - HEADER_HEIGHT) / CELL_Y_COUNT
-QR_SIZE = CELL_HEIGHT - 0.5 * cm
+FONT = "Helvetica-Bold"
+FONT_SIZE = 12
+LEADING = FONT_SIZE * 1.2  # ReportLab's default for text objects
+INSTRUCTIONS = "Make sure to remove this text before attaching the QR code!"
+
+QR_CACHE_SIZE = 4096  # encoded QR codes kept by every rendering process
+
+
+@dataclass(frozen=True)
+class Layout:
+    """PDF page geometry: a grid of `columns` x `rows` cells below a header."""
+
+    columns: int = 2
+    rows: int = 7
+    pagesize: tuple[float, float] = pagesizes.A4
+
+    @property
+    def page_width(self) -> float:
+        return self.pagesize[0]
+
+    @property
+    def page_height(self) -> float:
+        return self.pagesize[1]
+
+    @cached_property
+    def cell_width(self) -> float:
+        return (self.page_width - 2 * MARGIN) / self.columns
+
+    @cached_property
+    def cell_height(self) -> float:
+        return (self.page_height - 2 * MARGIN - HEADER_HEIGHT) / self.rows
+
+    @cached_property
+    def qr_size(self) -> float:
+        return min(self.cell_height - 0.5 * cm, self.cell_width / 2)
+
+    @cached_property
+    def chars_per_line(self) -> int:
+        max_width = self.cell_width - 2 * MARGIN - self.qr_size
+        return max(1, int(max_width / stringWidth("A", "Helvetica", 10)))
+
+    @property
+    def cells_per_page(self) -> int:
+        return self.columns * self.rows
+
+
+def paper_size(name: str, landscape: bool = False) -> tuple[float, float]:
+    """Page size from its ReportLab name, e.g. A4 or LETTER."""
+    size = getattr(pagesizes, name.upper(), None)
+    if not isinstance(size, tuple):
+        raise ValueError(f"Unknown paper size: {name}")
+    return pagesizes.landscape(size) if landscape else pagesizes.portrait(size)
+
 
+@lru_cache(maxsize=QR_CACHE_SIZE)
+def qr_code_runs(snowflake: int) -> tuple[int, tuple[tuple[int, int, int], ...]]:
+    """Encode a profile link as a QR code: (modules per side, (row, column, length) of every dark run)."""
+    matrix = make_qr(f"https://discord.com/users/{snowflake}").matrix
+    runs = []
+    for row, modules in enumerate(matrix):
+        start = None
+        for column, dark in enumerate([*modules, 0]):
+            if dark and start is None:
+                start = column
+            elif not dark and start is not None:
+                runs.append((row, start, column - start))
+                start = None
+    return len(matrix), tuple(runs)
 
-@contextmanager
-def generate_qr_code(snowflake: int):
-    with NamedTemporaryFile(suffix=".png") as f:
-        # Generate QR code and save it to the file
-        qr = make_qr(f"https://discord.com/users/{snowflake}")
-        qr.save(f.name, scale=5, border=0)
-        yield f
 
+@lru_cache(maxsize=QR_CACHE_SIZE)
+def wrapped(text: str, width: int) -> tuple[str, ...]:
+    return tuple(wrap(text, width=width))
 
-def generate_pdf(data_list, output_pdf):
+
+def draw_qr_code(c: canvas.Canvas, snowflake: int, x: float, y: float, size: float):
+    """Draw a QR code as vector rectangles, one per horizontal run of dark modules."""
+    module_count, runs = qr_code_runs(snowflake)
+    module = size / module_count
+    path = c.beginPath()
+    for row, column, length in runs:
+        path.rect(x + column * module, y + (module_count - row - 1) * module, length * module, module)
+    c.drawPath(path, stroke=0, fill=1)
+
+
+def generate_pdf(data_list, output_pdf, layout: Layout = Layout()):
 
     # Create a new PDF
-    c = canvas.Canvas(output_pdf, pagesize=A4)
+    c = canvas.Canvas(output_pdf, pagesize=layout.pagesize)
+    define_templates(c, layout)
     draw_header(c)
 
     for i, (name, qr_path) in enumerate(data_list):
-        col = i % CELL_X_COUNT
-        row = (i // CELL_X_COUNT) % CELL_Y_COUNT
-        draw_cell(c, col, row, name, qr_path)
-        if row == CELL_Y_COUNT - 1 and col == CELL_X_COUNT - 1:
+        col = i % layout.columns
+        row = (i // layout.columns) % layout.rows
+        draw_cell(c, layout, col, row, name, qr_path)
+        if row == layout.rows - 1 and col == layout.columns - 1 and i != len(data_list) - 1:
             c.showPage()
             draw_header(c)
 
     c.save()
 
 
-def draw_header(c: canvas.Canvas):
-    c.setFont("Helvetica-Bold", 16)
+def render_pdf(data_list, layout: Layout = Layout()) -> bytes:
+    """Render the PDF in memory, this is what the rendering pool runs."""
+    buffer = BytesIO()
+    generate_pdf(data_list, buffer, layout)
+    return buffer.getvalue()
+
+
+def define_templates(c: canvas.Canvas, layout: Layout):
+    """Draw everything that does not depend on the members once, as form XObjects reused on every page."""
+    c.beginForm("header")
+    c.setFont(FONT, 16)
     c.drawCentredString(
-        PAGE_WIDTH / 2,
-        PAGE_HEIGHT - MARGIN - HEADER_HEIGHT / 2,
+        layout.page_width / 2,
+        layout.page_height - MARGIN - HEADER_HEIGHT / 2,
         f"Super Secret Santa by TiTilda, rendered at {datetime.now()}",
     )
     # draw horizontal dotted line
     c.setDash(1, 1)
-    c.line(0, PAGE_HEIGHT - HEADER_HEIGHT - MARGIN, PAGE_WIDTH, PAGE_HEIGHT - HEADER_HEIGHT - MARGIN)
-    c.setDash()
+    c.line(
+        0,
+        layout.page_height - HEADER_HEIGHT - MARGIN,
+        layout.page_width,
+        layout.page_height - HEADER_HEIGHT - MARGIN,
+    )
+    c.endForm()
+
+    # the cell templates are drawn relative to the bottom left corner of the cell
+    bbox = (-1, -1, layout.cell_width + 1, layout.cell_height + 1)
+    c.beginForm("cell-border", *bbox)
+    c.setDash(1, 1)
+    c.rect(0, 0, layout.cell_width, layout.cell_height)
+    c.endForm()
+
+    # placed right below the name, so it starts where the name would
+    c.beginForm("cell-instructions", *bbox)
+    text = c.beginText(MARGIN, layout.cell_height - 2 * MARGIN)
+    text.setFont(FONT, FONT_SIZE)
+    for line in wrapped(INSTRUCTIONS, layout.chars_per_line):
+        text.textLine(line)
+    c.drawText(text)
+    c.endForm()
 
 
-def draw_cell(c: canvas.Canvas, col: int, row: int, name, giftee_snowflake):
-    x = MARGIN + col * CELL_WIDTH
-    y = MARGIN + (CELL_Y_COUNT - row - 1) * CELL_HEIGHT
+def draw_header(c: canvas.Canvas):
+    c.doForm("header")
 
-    # draw cell border
-    c.setDash(1, 1)
-    c.rect(x, y, CELL_WIDTH, CELL_HEIGHT)
-    c.setDash()
+
+def draw_cell(c: canvas.Canvas, layout: Layout, col: int, row: int, name, giftee_snowflake):
+    c.saveState()
+    c.translate(MARGIN + col * layout.cell_width, MARGIN + (layout.rows - row - 1) * layout.cell_height)
+    c.doForm("cell-border")
 
     # draw text
-    FONT_SIZE = 12
-    MAX_WIDTH = CELL_WIDTH - 2 * MARGIN - QR_SIZE
-    text = c.beginText(x + MARGIN, y + CELL_HEIGHT - 2 * MARGIN)
-    text.setFont("Helvetica-Bold", FONT_SIZE)
-    text_lines = f"Gift from {name}\nMake sure to remove this text before attaching the QR code!"
-    for line in text_lines.split("\n"):
-        wrapped_lines = wrap(line, width=int(MAX_WIDTH / c.stringWidth("A", "Helvetica", 10)))
-        for wrapped_line in wrapped_lines:
-            text.textLine(wrapped_line)
+    name_lines = wrapped(f"Gift from {name}", layout.chars_per_line)
+    text = c.beginText(MARGIN, layout.cell_height - 2 * MARGIN)
+    text.setFont(FONT, FONT_SIZE)
+    for line in name_lines:
+        text.textLine(line)
     c.drawText(text)
 
-    with generate_qr_code(giftee_snowflake) as qr_file:
-        c.drawImage(
-            qr_file.name,
-            x + CELL_WIDTH - QR_SIZE - MARGIN,
-            y + (CELL_HEIGHT - QR_SIZE) / 2,
-            width=QR_SIZE,
-            height=QR_SIZE,
-        )
+    c.saveState()
+    c.translate(0, -len(name_lines) * LEADING)
+    c.doForm("cell-instructions")
+    c.restoreState()
+
+    draw_qr_code(
+        c,
+        giftee_snowflake,
+        layout.cell_width - layout.qr_size - MARGIN,
+        (layout.cell_height - layout.qr_size) / 2,
+        layout.qr_size,
+    )
+    c.restoreState()
 
 
 if __name__ == "__main__":
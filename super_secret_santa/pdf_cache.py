@@ -0,0 +1,77 @@
+import json
+from collections.abc import AsyncIterator
+from dataclasses import astuple
+from hashlib import sha256
+
+from .database import get_connection
+from .rendering import MAX_PART_BYTES, layout
+
+
+def cache_key(data_list: list[tuple[str, int]]) -> str:
+    """Hash of everything that ends up in a campaign PDF: names, giftees and page geometry."""
+    content = json.dumps([astuple(layout()), MAX_PART_BYTES, data_list])
+    return sha256(content.encode()).hexdigest()
+
+
+class PartMissing(Exception):
+    """A part of a cached PDF was replaced while the others were being sent."""
+
+    def __init__(self, part: int):
+        super().__init__(f"Part {part} of the cached PDF is missing")
+        self.part = part
+
+
+async def cached_parts(guild_id: int, digest: str) -> AsyncIterator[bytes]:
+    """Yield the parts of a cached PDF one at a time, nothing if it is not (completely) cached.
+
+    Raises `PartMissing` if the entry is replaced after the first parts were yielded.
+    """
+    async with get_connection() as conn:
+        cur = conn.cursor()
+        await cur.execute(
+            "SELECT part, parts FROM PdfCache WHERE guild_id = %s AND digest = %s AND complete ORDER BY part;",
+            (guild_id, digest),
+        )
+        rows = await cur.fetchall()
+    # every part of the entry must be there, or it is a miss
+    numbers, counts = [part for part, _ in rows], {parts for _, parts in rows}
+    if not rows or counts != {len(rows)} or numbers != list(range(1, len(rows) + 1)):
+        return
+
+    for part, _ in rows:
+        async with get_connection() as conn:
+            cur = conn.cursor()
+            await cur.execute(
+                "SELECT data FROM PdfCache WHERE guild_id = %s AND digest = %s AND part = %s AND complete;",
+                (guild_id, digest, part),
+            )
+            row = await cur.fetchone()
+        if row is None:
+            raise PartMissing(part)
+        yield row[0]
+
+
+async def store_part(guild_id: int, digest: str, part: int, data: bytes):
+    """Cache a freshly rendered part, not visible until `mark_complete`."""
+    async with get_connection() as conn:
+        await conn.execute(
+            """
+            INSERT INTO PdfCache (guild_id, digest, part, data) VALUES (%s, %s, %s, %s)
+            ON CONFLICT (guild_id, digest, part) DO UPDATE SET data = EXCLUDED.data, complete = FALSE, parts = NULL;
+            """,
+            (guild_id, digest, part, data),
+        )
+
+
+async def mark_complete(guild_id: int, digest: str, parts: int):
+    """Make the `parts` stored parts visible, replacing whatever was cached for another version of the campaign."""
+    async with get_connection() as conn:
+        cur = conn.cursor()
+        await cur.execute("DELETE FROM PdfCache WHERE guild_id = %s AND digest <> %s;", (guild_id, digest))
+        await cur.execute(
+            """
+            UPDATE PdfCache SET complete = TRUE, parts = %s
+            WHERE guild_id = %s AND digest = %s AND part <= %s;
+            """,
+            (parts, guild_id, digest, parts),
+        )
@@ -0,0 +1,157 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from collections.abc import AsyncIterator, Awaitable, Callable
+from math import ceil
+from dataclasses import dataclass
+from functools import cache
+from time import monotonic
+from typing import TYPE_CHECKING
+
+from loguru import logger
+
+from . import metrics
+from .config import config
+
+if TYPE_CHECKING:
+    from .pdf import Layout
+
+EXECUTOR = config.get("PDF", "executor", fallback="process")
+WORKERS = config.getint("PDF", "workers", fallback=2)
+MAX_JOBS = config.getint("PDF", "max_jobs", fallback=WORKERS)
+MAX_PART_BYTES = config.getint("PDF", "max_upload_bytes", fallback=10 * 1024 * 1024)
+# first guess of the size of a page, and how full we aim to make each part
+ESTIMATED_PAGE_BYTES = 20 * 1024
+PART_FILL_RATIO = 0.8
+
+
+@dataclass
+class RenderStats:
+    jobs: int = 0
+    failures: int = 0
+    queued: int = 0  # jobs that had to wait for a free slot
+    waiting: int = 0  # jobs waiting right now
+    running: int = 0
+    render_seconds: float = 0.0
+    last_render_seconds: float = 0.0
+    max_render_seconds: float = 0.0
+
+
+stats = RenderStats()
+_slots = asyncio.Semaphore(MAX_JOBS)
+_executor: Executor | None = None
+
+
+@cache
+def layout() -> "Layout":
+    """Page geometry from config.ini. ReportLab and segno are only imported here, when the first PDF is needed."""
+    from .pdf import Layout, paper_size
+
+    return Layout(
+        columns=config.getint("PDF", "columns", fallback=2),
+        rows=config.getint("PDF", "rows", fallback=7),
+        pagesize=paper_size(
+            config.get("PDF", "paper", fallback="A4"), config.getboolean("PDF", "landscape", fallback=False)
+        ),
+    )
+
+
+def _get_executor() -> Executor:
+    # created on first use, so the worker processes are only spawned if someone renders a PDF
+    global _executor
+    if _executor is None:
+        match EXECUTOR:
+            case "process":
+                # not forked: the bot has threads by now, a forked child could deadlock on a lock one of them held
+                method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+                _executor = ProcessPoolExecutor(max_workers=WORKERS, mp_context=multiprocessing.get_context(method))
+            case "thread":
+                _executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="pdf")
+            case _:
+                raise ValueError(f"Unknown PDF executor: {EXECUTOR}")
+    return _executor
+
+
+async def render(data_list, on_queued: Callable[[int], Awaitable[None]] | None = None) -> bytes:
+    """Render a campaign PDF in the pool, at most `MAX_JOBS` at once.
+
+    When every slot is taken, `on_queued` is called with the number of jobs waiting before this one.
+    """
+    ahead = stats.waiting
+    stats.waiting += 1
+    try:
+        if _slots.locked():
+            stats.queued += 1
+            if on_queued:
+                await on_queued(ahead)
+        await _slots.acquire()
+    finally:
+        stats.waiting -= 1
+
+    from .pdf import render_pdf
+
+    stats.running += 1
+    start = monotonic()
+    try:
+        data = await asyncio.get_running_loop().run_in_executor(_get_executor(), render_pdf, data_list, layout())
+    except Exception:
+        stats.failures += 1
+        raise
+    finally:
+        stats.running -= 1
+        _slots.release()
+
+    elapsed = monotonic() - start
+    stats.jobs += 1
+    stats.render_seconds += elapsed
+    stats.last_render_seconds = elapsed
+    stats.max_render_seconds = max(stats.max_render_seconds, elapsed)
+    metrics.pdf_render_seconds.observe(elapsed)
+    logger.debug(f"Rendered a PDF of {len(data_list)} cells ({len(data)} bytes) in {elapsed:.2f}s")
+    return data
+
+
+async def render_parts(
+    data_list, max_bytes: int = MAX_PART_BYTES, on_queued: Callable[[int], Awaitable[None]] | None = None
+) -> AsyncIterator[bytes]:
+    """Render a campaign as as many PDFs as needed for each of them to fit in `max_bytes`.
+
+    Parts are yielded as soon as they are rendered, and the next one is already rendering while the
+    caller uploads the previous one; only one or two parts are ever held in memory. Part sizes start
+    from a conservative estimate and then follow the measured bytes per page, a part that still ends
+    up too big is split in half and rendered again.
+    """
+    cells_per_page = layout().cells_per_page
+    page_bytes = ESTIMATED_PAGE_BYTES
+
+    async def render_fitting(chunk, notify: bool = False) -> list[bytes]:
+        data = await render(chunk, on_queued if notify else None)
+        pages = ceil(len(chunk) / cells_per_page)
+        if len(data) <= max_bytes or pages == 1:
+            return [data]
+        half = pages // 2 * cells_per_page
+        return await render_fitting(chunk[:half]) + await render_fitting(chunk[half:])
+
+    def next_chunk(start: int):
+        pages = max(1, int(max_bytes * PART_FILL_RATIO / page_bytes))
+        return data_list[start : start + pages * cells_per_page]
+
+    chunk = next_chunk(0)
+    position = len(chunk)
+    task = asyncio.create_task(render_fitting(chunk, notify=True))  # only the first part tells about queueing
+    try:
+        while task is not None:
+            parts = await task
+            page_bytes = sum(map(len, parts)) / max(1, ceil(len(chunk) / cells_per_page))
+
+            task = None
+            if position < len(data_list):
+                chunk = next_chunk(position)
+                position += len(chunk)
+                task = asyncio.create_task(render_fitting(chunk))
+
+            for part in parts:
+                yield part
+    finally:
+        if task is not None:
+            task.cancel()
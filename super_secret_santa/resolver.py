@@ -0,0 +1,165 @@
+import asyncio
+from collections.abc import Awaitable, Callable, Iterable
+from dataclasses import dataclass
+
+import discord
+from loguru import logger
+
+from . import constants, events
+from .bot import bot
+from .cache import MISSING, TTLCache
+
+
+@dataclass
+class ResolverStats:
+    gateway_hits: int = 0  # found in py-cord's own cache
+    cache_hits: int = 0  # found in our LRU cache
+    coalesced: int = 0  # waited for a fetch of the same ID already in flight
+    fetches: int = 0  # REST calls
+    not_found: int = 0
+
+
+stats = ResolverStats()
+
+# None is cached too, so users who left are not fetched over and over
+_users: TTLCache[int, discord.User | None] = TTLCache(constants.RESOLVER_CACHE_SIZE, constants.RESOLVER_CACHE_TTL)
+_members: TTLCache[tuple[int, int], discord.Member | None] = TTLCache(
+    constants.RESOLVER_CACHE_SIZE, constants.RESOLVER_CACHE_TTL
+)
+_in_flight: dict[tuple[int, object], asyncio.Future] = {}
+
+
+async def _resolve[K](cache: TTLCache[K, object], key: K, fetch: Callable[[], Awaitable]):
+    if (cached := cache.get(key)) is not MISSING:
+        stats.cache_hits += 1
+        return cached
+
+    in_flight_key = (id(cache), key)
+    if (pending := _in_flight.get(in_flight_key)) is not None:
+        stats.coalesced += 1
+        return await asyncio.shield(pending)
+
+    future = asyncio.get_running_loop().create_future()
+    _in_flight[in_flight_key] = future
+    try:
+        stats.fetches += 1
+        try:
+            result = await fetch()
+        except discord.NotFound:
+            stats.not_found += 1
+            result = None
+        cache.set(key, result)
+        future.set_result(result)
+        return result
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        future.exception()  # mark it as retrieved, nobody may be waiting for it
+        raise
+    finally:
+        del _in_flight[in_flight_key]
+
+
+def cached_user(user_id: int) -> discord.User | None:
+    """Look a user up without making any REST call."""
+    if (user := bot.get_user(user_id)) is not None:
+        return user
+    return _users.get(user_id, None)
+
+
+async def get_user(user_id: int) -> discord.User | None:
+    """Resolve a user from the gateway cache, our cache or REST, in this order. None if it does not exist."""
+    if (user := bot.get_user(user_id)) is not None:
+        stats.gateway_hits += 1
+        return user
+    return await _resolve(_users, user_id, lambda: bot.fetch_user(user_id))
+
+
+async def get_member(guild: discord.Guild, user_id: int) -> discord.Member | None:
+    """Resolve a guild member like `get_user`. None if they are not in the guild anymore."""
+    if (member := guild.get_member(user_id)) is not None:
+        stats.gateway_hits += 1
+        return member
+    return await _resolve(_members, (guild.id, user_id), lambda: guild.fetch_member(user_id))
+
+
+async def get_users(user_ids: Iterable[int]) -> dict[int, discord.User]:
+    """Resolve many users at once with bounded concurrency, leaving out those who do not exist."""
+    semaphore = asyncio.Semaphore(constants.USER_FETCH_CONCURRENCY)
+    users: dict[int, discord.User] = {}
+
+    async def resolve(user_id: int):
+        async with semaphore:
+            try:
+                if (user := await get_user(user_id)) is not None:
+                    users[user_id] = user
+            except discord.HTTPException as e:
+                logger.warning(f"Could not fetch user {user_id}: {e}")
+
+    await asyncio.gather(*(resolve(user_id) for user_id in set(user_ids)))
+    return users
+
+
+async def get_members(guild: discord.Guild, user_ids: Iterable[int]) -> dict[int, discord.Member | None]:
+    """Resolve many members of a guild at once, None for those who left.
+
+    Cached members are served directly, the others are requested through the gateway in chunks of
+    `MEMBER_CHUNK_SIZE` IDs (all chunks at once), falling back to bounded concurrent REST fetches
+    if a chunk request times out.
+    """
+    members: dict[int, discord.Member | None] = {}
+    missing = []
+    for user_id in set(user_ids):
+        if (member := guild.get_member(user_id)) is not None:
+            stats.gateway_hits += 1
+            members[user_id] = member
+        elif (cached := _members.get((guild.id, user_id))) is not MISSING:
+            stats.cache_hits += 1
+            members[user_id] = cached
+        else:
+            missing.append(user_id)
+
+    semaphore = asyncio.Semaphore(constants.USER_FETCH_CONCURRENCY)
+
+    async def fetch(user_id: int):
+        async with semaphore:
+            try:
+                members[user_id] = await get_member(guild, user_id)
+            except discord.HTTPException as e:
+                logger.warning(f"Could not fetch member {user_id}: {e}")
+                members[user_id] = None
+
+    async def query(chunk: list[int]):
+        try:
+            stats.fetches += 1
+            found = await guild.query_members(user_ids=chunk, limit=len(chunk), cache=True)
+        except (TimeoutError, RuntimeError) as e:
+            logger.warning(f"Could not query {len(chunk)} members of guild {guild.id}, fetching them instead: {e}")
+            await asyncio.gather(*(fetch(user_id) for user_id in chunk))
+            return
+
+        for member in found:
+            members[member.id] = member
+            _members.set((guild.id, member.id), member)
+        for user_id in chunk:
+            if user_id not in members:
+                stats.not_found += 1
+                members[user_id] = None
+                _members.set((guild.id, user_id), None)
+
+    size = constants.MEMBER_CHUNK_SIZE
+    await asyncio.gather(*(query(missing[i : i + size]) for i in range(0, len(missing), size)))
+    return members
+
+
+def invalidate_guild(guild_id: int | None):
+    """Forget the members of a guild, e.g. when its campaign is deleted, or of every guild with None."""
+    if guild_id is None:
+        _members.clear()
+    else:
+        _members.invalidate_where(lambda key: key[0] == guild_id)
+
+
+events.subscribe(events.Event.CAMPAIGN, invalidate_guild)
@@ -1,34 +1,160 @@
-from random import shuffle
+from collections import deque
+from collections.abc import Iterable
+from enum import StrEnum
+from random import Random
+from time import monotonic
 
+# before falling back to matching, try a few uniformly random assignments that may already be valid
+REJECTION_ATTEMPTS = 20
+GREEDY_PROBES = 8
 
-def secret_santa_algo(lst: list[tuple]) -> list:
-    """Build a list of pairs of Secret Santa assignments."""
+
+class InfeasibleAssignmentError(ValueError):
+    """No assignment satisfies the constraints: `member` cannot be given any free giftee."""
+
+    def __init__(self, member):
+        super().__init__(f"No valid assignment exists for {member}")
+        self.member = member
+
+
+class AssignmentMode(StrEnum):
+    # any permutation without fixed points, i.e. nobody gets themselves
+    DERANGEMENT = "derangement"
+    # one single gift chain going through every participant
+    SINGLE_CYCLE = "single-cycle"
+
+
+def single_cycle(n: int, rng: Random) -> list[int]:
+    """Uniformly random cyclic permutation of range(n) (Sattolo's algorithm), in O(n)."""
+    permutation = list(range(n))
+    for i in range(n - 1, 0, -1):
+        j = rng.randrange(i)  # j < i, unlike Fisher-Yates
+        permutation[i], permutation[j] = permutation[j], permutation[i]
+    return permutation
+
+
+def derangement(n: int, rng: Random) -> list[int]:
+    """Uniformly random derangement of range(n), in expected O(n).
+
+    A random permutation is a derangement with probability ~1/e, so rejection sampling needs
+    e attempts on average.
+    """
+    permutation = list(range(n))
+    while True:
+        rng.shuffle(permutation)
+        if all(i != j for i, j in enumerate(permutation)):
+            return permutation
+
+
+def constrained_derangement(
+    n: int, forbidden: dict[int, set[int]], rng: Random, deadline: float | None = None
+) -> list[int]:
+    """Random derangement of range(n) avoiding every `j in forbidden[i]`, as a bipartite matching.
+
+    Greedy random matching first, then one BFS augmenting path search (Hopcroft-Karp style) per
+    giver left over. If some giver has no augmenting path, no perfect matching exists.
+    """
+    receiver_of = [-1] * n
+    giver_of = [-1] * n
+    givers = list(range(n))
+    receivers = list(range(n))
+    rng.shuffle(givers)
+    rng.shuffle(receivers)
+
+    def allowed(i: int, j: int) -> bool:
+        return i != j and j not in forbidden.get(i, ())
+
+    for i in givers:
+        for _ in range(GREEDY_PROBES):
+            j = rng.randrange(n)
+            if giver_of[j] == -1 and allowed(i, j):
+                receiver_of[i], giver_of[j] = j, i
+                break
+
+    for i in givers:
+        if receiver_of[i] != -1:
+            continue
+
+        parent: dict[int, int] = {}  # receiver -> giver through which the search reached it
+        queue = deque([i])
+        free = None
+        while queue and free is None:
+            if deadline is not None and monotonic() > deadline:
+                raise TimeoutError("Ran out of time looking for a valid assignment")
+            u = queue.popleft()
+            for j in receivers:
+                if j in parent or not allowed(u, j):
+                    continue
+                parent[j] = u
+                if giver_of[j] == -1:
+                    free = j
+                    break
+                queue.append(giver_of[j])
+
+        if free is None:
+            raise InfeasibleAssignmentError(i)
+
+        # flip the augmenting path back to i
+        j = free
+        while j != -1:
+            u = parent[j]
+            previous = receiver_of[u]
+            receiver_of[u], giver_of[j] = j, u
+            j = previous
+
+    return receiver_of
+
+
+def secret_santa_algo(
+    lst: list,
+    mode: AssignmentMode = AssignmentMode.DERANGEMENT,
+    rng: Random | None = None,
+    forbidden: Iterable[tuple] = (),
+    time_budget: float | None = None,
+) -> list[tuple]:
+    """Build a list of pairs of Secret Santa assignments.
+
+    Pass a seeded `random.Random` as `rng` to get reproducible assignments. `forbidden` holds
+    (giver, giftee) pairs that must not be drawn; with constraints, the search gives up with a
+    `TimeoutError` after `time_budget` seconds and raises `InfeasibleAssignmentError` when there
+    is provably no valid assignment. Single-cycle mode only retries random cycles under
+    constraints, as finding one is NP-hard in general.
+    """
     if len(lst) < 2:
         raise ValueError("List must have at least 2 elements")
 
-    people = lst[:]
-    shuffled_list = lst[:]
-    shuffle(people)
-    shuffle(shuffled_list)
-    result = []
-
-    i = 0
-    while i < len(lst) - 2:
-        giver = people.pop()
-        receiver = shuffled_list.pop()
-
-        if giver == receiver:
-            people.insert(0, giver)
-            giver = people.pop()
-
-        result.append((giver, receiver))
-        i += 1
-
-    # Handling the last two pairs
-    if people[0] != shuffled_list[0] and people[1] != shuffled_list[1]:
-        result.append((people[0], shuffled_list[0]))
-        result.append((people[1], shuffled_list[1]))
-    else:
-        result.append((people[0], shuffled_list[1]))
-        result.append((people[1], shuffled_list[0]))
-    return result
+    rng = rng or Random()
+    match mode:
+        case AssignmentMode.SINGLE_CYCLE:
+            sample = single_cycle
+        case AssignmentMode.DERANGEMENT:
+            sample = derangement
+        case _:
+            raise ValueError(f"Unknown assignment mode: {mode}")
+
+    index = {member: i for i, member in enumerate(lst)}
+    constraints: dict[int, set[int]] = {}
+    for giver, giftee in forbidden:
+        if giver in index and giftee in index:
+            constraints.setdefault(index[giver], set()).add(index[giftee])
+
+    def valid(permutation: list[int]) -> bool:
+        return all(permutation[i] not in giftees for i, giftees in constraints.items())
+
+    deadline = monotonic() + time_budget if time_budget is not None else None
+    attempt = 0
+    while True:
+        permutation = sample(len(lst), rng)
+        if valid(permutation):
+            break
+        attempt += 1
+        if mode == AssignmentMode.DERANGEMENT and attempt >= REJECTION_ATTEMPTS:
+            try:
+                permutation = constrained_derangement(len(lst), constraints, rng, deadline)
+            except InfeasibleAssignmentError as e:
+                raise InfeasibleAssignmentError(lst[e.member]) from None
+            break
+        if deadline is not None and monotonic() > deadline:
+            raise TimeoutError("Ran out of time looking for a valid assignment")
+
+    return [(giver, lst[j]) for giver, j in zip(lst, permutation)]
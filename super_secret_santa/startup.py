@@ -0,0 +1,67 @@
+import sys
+from contextlib import contextmanager
+from time import monotonic
+
+from loguru import logger
+
+from .bot import bot
+from .config import config
+
+_started_at = monotonic()
+_ready = False
+
+
+@contextmanager
+def phase(name: str):
+    """Log how long a step of the startup took."""
+    start = monotonic()
+    yield
+    logger.info(f"Startup: {name} took {(monotonic() - start) * 1000:.0f} ms")
+
+
+def setup():
+    """Register the event listeners and commands on the bot, importing everything they need."""
+    with phase("loading the commands"):
+        from . import commands, event_listeners
+
+        for module in (event_listeners, commands):
+            module.setup()
+
+
+async def prepare():
+    """Everything that does not need the gateway, done once before logging in.
+
+    Buttons and commands can be handled as soon as the first events arrive, even before `on_ready`.
+    """
+    from . import migrate
+    from .database import get_connection, open_pools
+    from .views import CampaignView
+
+    with phase("connecting to the database"):
+        await open_pools()
+    with phase("migrating the database"):
+        async with get_connection() as conn:
+            await migrate.migrate(conn, apply=config.getboolean("Postgres", "migrate", fallback=True))
+    bot.add_view(CampaignView())
+
+
+def ready() -> bool:
+    """Log the time it took to be ready, True only the first time: later calls are reconnections."""
+    global _ready
+    if _ready:
+        return False
+    _ready = True
+    logger.info(f"Startup: ready {monotonic() - _started_at:.1f}s after starting")
+    return True
+
+
+def run(token: str):
+    """Set the bot up, connect to the database, then log in to the gateway until stopped."""
+    setup()
+    try:
+        bot.loop.run_until_complete(prepare())
+    except Exception as e:
+        # exiting lets the cluster launcher, or the service manager, retry later
+        logger.critical(f"Could not start:\n{e}")
+        sys.exit(1)
+    bot.run(token)
@@ -1,14 +1,44 @@
+import asyncio
+
 import discord
-import psycopg.errors
 from discord.interactions import Interaction
 from psycopg import AsyncCursor
 from loguru import logger
-from time import sleep
 
-from . import constants
-from .bot import bot
-from .secret_santa import secret_santa_algo
-from .database import get_connection, create_santa_assignment
+from . import campaign_cache, campaign_message, constants, events, metrics, outbox, resolver
+from .dispatcher import GIFTEE, DirectMessage, DispatchReport, describe
+from .secret_santa import InfeasibleAssignmentError, secret_santa_algo
+from .database import (
+    JoinStatus,
+    LeaveStatus,
+    StartStatus,
+    check_start,
+    get_connection,
+    join_campaign,
+    leave_campaign,
+    start_campaign,
+)
+
+JOIN_MESSAGES = {
+    JoinStatus.JOINED: "You have joined the **Secret Santa campaign!**",
+    JoinStatus.ALREADY_JOINED: "You have already joined the **Secret Santa campaign!**",
+    JoinStatus.STARTED: "The campaign has already started. You cannot join now.",
+    JoinStatus.NO_CAMPAIGN: "There is no Secret Santa campaign on this server. You may create one with `/santa create <name>`.",
+}
+
+LEAVE_MESSAGES = {
+    LeaveStatus.LEFT: "You have left the **Secret Santa campaign!**",
+    LeaveStatus.ORGANIZER: "You are the organizer. To delete the campaign, use `/santa delete`",
+    LeaveStatus.STARTED: "The campaign has already started. You cannot leave now.",
+    LeaveStatus.NOT_MEMBER: "You are not part of a campaign on this server!",
+}
+
+START_MESSAGES = {
+    StartStatus.NO_MEMBERS: "No members have joined a campaign or none exists!",
+    StartStatus.TOO_FEW_MEMBERS: "You need at least 3 members to start the Secret Santa campaign!",
+    StartStatus.NOT_ORGANIZER: "You can only start the campaign if you are the organizer!",
+    StartStatus.NOT_AWAITING: "The campaign is not in the awaiting state!",
+}
 
 
 class CampaignView(discord.ui.View):
@@ -16,190 +46,164 @@ class CampaignView(discord.ui.View):
         super().__init__(timeout=None)  # persistent
 
     @discord.ui.button(label="Join Secret Santa!", custom_id="join-sss", style=discord.ButtonStyle.primary, emoji="🎅")
+    @metrics.timed("join_button")
     async def join_button_callback(self, button, interaction: Interaction):
         await interaction.response.defer(ephemeral=True)
-        async with get_connection() as conn:
-            try:
+        guild_id, user_id = interaction.guild.id, interaction.user.id
+        campaign = await campaign_cache.get_campaign(guild_id)
+        if campaign is None:
+            status = JoinStatus.NO_CAMPAIGN
+        elif campaign.state == "started":
+            status = JoinStatus.STARTED
+        elif user_id in campaign.members:
+            status = JoinStatus.ALREADY_JOINED
+        else:
+            async with get_connection() as conn:
                 cur = conn.cursor()
-                await cur.advisory_lock(interaction.guild.id)
-
-                await cur.execute(
-                    "SELECT state FROM Campaigns WHERE guild_id = %s AND state = 'started';", (interaction.guild.id,)
-                )
-                started = await cur.fetchone()
-                if started:
-                    await interaction.followup.send(
-                        "The campaign has already started. You cannot join now.",
-                        delete_after=constants.DELETE_AFTER_DELAY,
-                        ephemeral=True,
-                    )
-                    return
-
-                try:
-                    await cur.execute(
-                        "INSERT INTO Memberships (user_id, guild_id) VALUES (%s, %s);",
-                        (interaction.user.id, interaction.guild.id),
-                    )
-                except psycopg.errors.ForeignKeyViolation:
-                    await interaction.followup.send(
-                        "There is no Secret Santa campaign on this server. You may create one with `/santa create <name>`.",
-                        delete_after=constants.DELETE_AFTER_DELAY,
-                        ephemeral=True,
-                    )
-                    return
-            except psycopg.errors.UniqueViolation:
-                await interaction.followup.send(
-                    "You have already joined the **Secret Santa campaign!**",
-                    delete_after=constants.DELETE_AFTER_DELAY,
-                    ephemeral=True,
+                status = await join_campaign(
+                    cur, guild_id, user_id, notify=events.notification(guild_id, events.Event.MEMBERS)
                 )
-                return
+            if status == JoinStatus.JOINED:
+                campaign_cache.member_joined(guild_id, user_id)
+                campaign_message.member_joined(guild_id, interaction.message, interaction.user.display_name)
+            else:
+                campaign_cache.invalidate(guild_id)  # it was out of date
 
         await interaction.followup.send(
-            "You have joined the **Secret Santa campaign!**", ephemeral=True, delete_after=constants.DELETE_AFTER_DELAY
+            JOIN_MESSAGES[status], ephemeral=True, delete_after=constants.DELETE_AFTER_DELAY
         )
-        logger.info(f"User {interaction.user.global_name} joined the campaign {interaction.message.id}")
+        if status == JoinStatus.JOINED:
+            logger.info(f"User {interaction.user.global_name} joined the campaign {interaction.message.id}")
 
     @discord.ui.button(
         label="Leave Secret Santa!", custom_id="leave-sss", style=discord.ButtonStyle.danger, emoji="🎄"
     )
+    @metrics.timed("leave_button")
     async def leave_button_callback(self, button, interaction: discord.Interaction):
         await interaction.response.defer(ephemeral=True)
-        async with get_connection() as conn:
-            # if the user is the organizer, they cannot leave
-            cur = conn.cursor()
-            await cur.advisory_lock(interaction.guild.id)
-            await cur.execute(
-                "SELECT is_organizer FROM Memberships WHERE user_id = %s AND guild_id = %s AND is_organizer = TRUE;",
-                (interaction.user.id, interaction.guild.id),
-            )
-            is_organizer = await cur.fetchone()
-            if is_organizer:
-                await interaction.followup.send(
-                    "You are the organizer. To delete the campaign, use `/santa delete`",
-                    delete_after=constants.DELETE_AFTER_DELAY,
-                    ephemeral=True,
-                )
-                return
-
-            # if the campaign is already started, the user cannot leave
-            await cur.execute(
-                "SELECT state FROM Campaigns WHERE guild_id = %s AND state = 'started';",
-                (interaction.guild.id,),
-            )
-            started = await cur.fetchone()
-            if started:
-                await interaction.followup.send(
-                    "The campaign has already started. You cannot leave now.",
-                    delete_after=constants.DELETE_AFTER_DELAY,
-                    ephemeral=True,
+        guild_id, user_id = interaction.guild.id, interaction.user.id
+        campaign = await campaign_cache.get_campaign(guild_id)
+        if campaign is None:
+            status = LeaveStatus.NOT_MEMBER
+        elif campaign.organizer_id == user_id:
+            status = LeaveStatus.ORGANIZER
+        elif campaign.state == "started":
+            status = LeaveStatus.STARTED
+        elif user_id not in campaign.members:
+            status = LeaveStatus.NOT_MEMBER
+        else:
+            async with get_connection() as conn:
+                cur = conn.cursor()
+                status = await leave_campaign(
+                    cur, guild_id, user_id, notify=events.notification(guild_id, events.Event.MEMBERS)
                 )
-                return
-
-            await cur.execute(
-                "DELETE FROM Memberships WHERE user_id = %s AND guild_id = %s RETURNING *;",
-                (interaction.user.id, interaction.guild.id),
-            )
-
-            result = await cur.fetchone()
-
-            await interaction.followup.send(
-                (
-                    "You have left the **Secret Santa campaign!**"
-                    if result
-                    else "You are not part of a campaign on this server!"
-                ),
-                delete_after=constants.DELETE_AFTER_DELAY,
-                ephemeral=True,
-            )
+            if status == LeaveStatus.LEFT:
+                campaign_cache.member_left(guild_id, user_id)
+                campaign_message.member_left(guild_id, interaction.message, interaction.user.display_name)
+            else:
+                campaign_cache.invalidate(guild_id)  # it was out of date
 
+        await interaction.followup.send(
+            LEAVE_MESSAGES[status], delete_after=constants.DELETE_AFTER_DELAY, ephemeral=True
+        )
+        if status == LeaveStatus.LEFT:
             logger.info(f"User {interaction.user.global_name} left the campaign {interaction.message.id}")
 
     @discord.ui.button(
         label="Start Secret Santa!", custom_id="start-sss", style=discord.ButtonStyle.success, emoji="🎁"
     )
+    @metrics.timed("start_button")
     async def start_button_callback(self, button, interaction: discord.Interaction):
         await interaction.response.defer()
 
         async with get_connection() as conn:
             cur: AsyncCursor = conn.cursor()
-            await cur.advisory_lock(interaction.guild.id)
-
-            await cur.execute(
-                "SELECT user_id FROM Memberships WHERE guild_id = %s;",
-                (interaction.guild.id,),
+            status, members, exclusions, last_pairs = await check_start(
+                cur, interaction.guild.id, interaction.user.id
             )
-            members: list[int] = [member[0] for member in await cur.fetchall()]
-
-            if len(members) < 3:
-                if len(members) == 0:
-                    error_message = "No members have joined a campaign or none exists!"
-                else:
-                    error_message = "You need at least 3 members to start the Secret Santa campaign!"
+            if status != StartStatus.READY:
                 await interaction.followup.send(
-                    error_message, delete_after=constants.DELETE_AFTER_DELAY, ephemeral=True
+                    START_MESSAGES[status], delete_after=constants.DELETE_AFTER_DELAY, ephemeral=True
                 )
                 return
 
-            # only continue if the user is the organizer
-            await cur.execute(
-                "SELECT is_organizer FROM Memberships WHERE user_id = %s AND guild_id = %s AND is_organizer = TRUE;",
-                (interaction.user.id, interaction.guild.id),
-            )
-
-            is_organizer = await cur.fetchone()
-            if not is_organizer:
+            try:
+                try:
+                    assignments = await asyncio.to_thread(
+                        secret_santa_algo,
+                        members,
+                        forbidden=exclusions + last_pairs,
+                        time_budget=constants.ASSIGNMENT_TIME_BUDGET,
+                    )
+                except (InfeasibleAssignmentError, TimeoutError):
+                    # avoiding last year's pairs is best effort, the organizer's exclusions are not
+                    assignments = await asyncio.to_thread(
+                        secret_santa_algo,
+                        members,
+                        forbidden=exclusions,
+                        time_budget=constants.ASSIGNMENT_TIME_BUDGET,
+                    )
+            except InfeasibleAssignmentError as e:
                 await interaction.followup.send(
-                    "You can only start the campaign if you are the organizer!",
-                    delete_after=constants.DELETE_AFTER_DELAY,
+                    f"No valid assignment exists for <@{e.member}> with the current exclusions! "
+                    "Check them with `/santa exclusions` and remove some with `/santa include`.",
                     ephemeral=True,
                 )
                 return
-
-            # only continue if the campaign is in the awaiting state
-            await cur.execute(
-                "SELECT state FROM Campaigns WHERE guild_id = %s;",
-                (interaction.guild.id,),
-            )
-            state = await cur.fetchone()
-            if state[0] != "awaiting":
+            except TimeoutError:
                 await interaction.followup.send(
-                    "The campaign is not in the awaiting state!",
-                    delete_after=constants.DELETE_AFTER_DELAY,
+                    "Could not find a valid assignment in time, the exclusions are too strict! "
+                    "Check them with `/santa exclusions` and remove some with `/santa include`.",
                     ephemeral=True,
                 )
                 return
 
-            await cur.execute(
-                "UPDATE Campaigns SET state = 'started' WHERE guild_id = %s;",
-                (interaction.guild.id,),
-            )
+            await start_campaign(cur, interaction.guild.id, assignments)
+            await events.publish(cur, interaction.guild.id, events.Event.CAMPAIGN)
 
-            await interaction.channel.send(
-                "The Secret Santa campaign has started! Check your DMs for your giftee!",
+            # only cached users here: no REST calls while the transaction is open
+            logger.debug("Secret Santa assignments:")
+            for giver, receiver in assignments:
+                giver_user, receiver_user = resolver.cached_user(giver), resolver.cached_user(receiver)
+                logger.debug(f"\t{describe(giver, giver_user)} -> {describe(receiver, receiver_user)}")
+
+            await outbox.enqueue(
+                cur,
+                interaction.guild.id,
+                [
+                    DirectMessage(
+                        giver,
+                        f"Your Secret Santa assignment is: {GIFTEE}. You can message them anonymously with `/santa message <message>`.",
+                        giftee_id=receiver,
+                    )
+                    for giver, receiver in assignments
+                ],
             )
 
-            assignments = secret_santa_algo(members)
+        # the assignments and their notifications are committed, now deliver them
+        campaign_cache.campaign_started(interaction.guild.id, (giver for giver, _ in assignments))
+        campaign_message.campaign_started(interaction.guild.id, interaction.message)
+        await interaction.channel.send(
+            "The Secret Santa campaign has started! Check your DMs for your giftee!",
+        )
 
-            for giver, receiver in assignments:
-                await create_santa_assignment(cur, interaction.guild.id, giver, receiver)
+        progress = await interaction.followup.send(
+            f"Sending assignments: 0/{len(assignments)}", ephemeral=True, wait=True
+        )
 
-            logger.debug("Secret Santa assignments:")
-            [
-                logger.debug(
-                    f"\t{(await bot.fetch_user(a[0])).global_name} -> {(await bot.fetch_user(a[1])).global_name}"
-                )
-                for a in assignments
-            ]
+        async def on_progress(report: DispatchReport):
+            await progress.edit(content=f"Sending assignments: {report.done}/{report.total}")
 
-            for giver, receiver in assignments:
-                try:
-                    user = await bot.fetch_user(giver)
-                    giftee = await bot.fetch_user(receiver)
-                    await user.send(
-                        f"Your Secret Santa assignment is: {giftee.mention} ({giftee.global_name}). You can message them anonymously with `/santa message <message>`.",
-                    )
-                    logger.debug(f"Sent message to {user.id} ({user.global_name})")
-                except Exception as e:
-                    logger.error(f"Could not send message to user:\n{e}")
-                sleep(0.5)
+        report = await outbox.deliver_pending(interaction.guild.id, on_progress=on_progress)
+
+        if report.total == 0:
+            # nothing left to claim: another process is sending them
+            await progress.edit(content="The assignments are being sent in the background.")
+        elif report.failed:
+            await progress.edit(
+                content=f"Sent {len(report.sent)}/{report.total} assignments, the others will be retried later. "
+                "These members could not be reached yet: "
+                + ", ".join(f"<@{message.recipient_id}>" for message in report.failed)
+            )
+        else:
+            await progress.edit(content=f"All {report.total} assignments have been sent!")